@@ -4,16 +4,68 @@ Database setup script for FUSE Virtual File System.
 This script creates the necessary database and tables for the filesystem.
 """
 import os
+import re
 import sys
+import string
 import argparse
-import getpass
-import mysql.connector
-from mysql.connector import Error
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
-def parse_args():
-    """Parse command line arguments."""
+# mysql.connector and getpass are imported where they're used, so that
+# --help and argument errors don't pay for loading the driver
+
+# Admin connection pools, by (host, port, admin user), so repeated setups
+# in one process skip the connect and authentication handshake. A pool opens
+# all its connections up front, so it only grows to the parallel setup workers
+_ADMIN_POOLS = {}
+_ADMIN_POOL_SIZE = 3
+
+# Contents of the generated .env file
+_ENV_TEMPLATE = string.Template("""
+# Database configuration
+DB_HOST=$host
+DB_USER=$db_user
+DB_PASSWORD=$db_password
+DB_NAME=$db_name
+DB_PORT=$port
+
+# Filesystem paths
+MOUNT_POINT=~/fuse_mount
+STORAGE_PATH=~/fuse_storage
+
+# Google Drive API
+GOOGLE_CREDENTIALS_FILE=credentials.json
+GOOGLE_TOKEN_FILE=token.json
+
+# LFU Cache settings
+CACHE_SIZE=100
+CACHE_DIR=~/fuse_storage/cache
+
+# Sync settings
+SYNC_INTERVAL=300
+MAX_SYNC_RETRIES=3
+
+# Security settings
+ENCRYPTION_ENABLED=False
+ENCRYPTION_KEY=
+
+# Logging configuration
+LOG_LEVEL=INFO
+LOG_FILE=fuse_fs.log
+
+# Performance tuning
+BUFFER_SIZE=4096
+""")
+
+# Database and user names are interpolated into the statements, so only plain identifiers are accepted
+_IDENTIFIER = re.compile(r'^[A-Za-z0-9_]+$')
+
+def _build_parser():
+    """Build the command line argument parser."""
+    # Options must be spelled out in full, which skips matching prefixes
     parser = argparse.ArgumentParser(
-        description="Setup database for FUSE Virtual File System"
+        description="Setup database for FUSE Virtual File System",
+        allow_abbrev=False
     )
     
     parser.add_argument(
@@ -47,102 +99,157 @@ def parse_args():
         default="fuse_user"
     )
     
-    return parser.parse_args()
+    return parser
 
-def setup_database(host, port, admin_user, admin_password, db_name, db_user, db_password):
-    """Set up the database and user."""
-    try:
-        # Connect to MySQL server as admin
-        connection = mysql.connector.connect(
+# Built once, so main() can be called repeatedly when this is imported as a module
+_PARSER = _build_parser()
+
+def parse_args():
+    """Parse command line arguments."""
+    return _PARSER.parse_args()
+
+def get_admin_pool(host, port, admin_user, admin_password, size=1):
+    """
+    Get the pool of admin connections to a MySQL server, creating it on first use.
+    
+    Args:
+        size: Number of connections needed at once; a smaller existing pool is replaced
+    """
+    from mysql.connector import pooling
+    
+    key = (host, port, admin_user)
+    pool = _ADMIN_POOLS.get(key)
+    if pool is not None and pool.pool_size < size:
+        pool._remove_connections()
+        pool = None
+    if pool is None:
+        # Only DDL runs on these connections, so there's no session state to reset
+        pool = pooling.MySQLConnectionPool(
+            pool_name="fuse_setup",
+            pool_size=size,
+            pool_reset_session=False,
             host=host,
             port=port,
             user=admin_user,
             password=admin_password
         )
-        
-        if connection.is_connected():
-            cursor = connection.cursor()
+        _ADMIN_POOLS[key] = pool
+    return pool
+
+def setup_database(host, port, admin_user, admin_password, db_name, db_user, db_password, env_path=".env"):
+    """Set up the database and user."""
+    from mysql.connector import Error, errorcode
+    
+    for name in (db_name, db_user):
+        if not _IDENTIFIER.match(name):
+            print(f"Error: '{name}' is not a valid name (letters, digits and underscores only)")
+            return False
             
-            # Create database if it doesn't exist
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-            print(f"Database '{db_name}' created or already exists.")
+    # The password goes into a quoted string literal. Quotes are escaped by
+    # doubling them, and backslashes are made literal for the session, which
+    # together read the same whatever the server's sql_mode is
+    password = db_password.replace("'", "''")
+    literal_backslashes = "SET SESSION sql_mode = CONCAT_WS(',', NULLIF(@@sql_mode, ''), 'NO_BACKSLASH_ESCAPES')"
+    
+    try:
+        # Connect to MySQL server as admin. The pool already checks the connection
+        # when lending it, and closing it hands it back to the pool
+        admin_pool = get_admin_pool(host, port, admin_user, admin_password)
+        with contextlib.closing(admin_pool.get_connection()) as connection, \
+                contextlib.closing(connection.cursor()) as cursor:
+            create_database = f"CREATE DATABASE IF NOT EXISTS {db_name}"
+            grant = f"GRANT ALL PRIVILEGES ON {db_name}.* TO '{db_user}'@'localhost'"
             
-            # Create user if it doesn't exist
+            # Create the database and user and grant privileges in a single send
             # Note: The syntax varies depending on MySQL version
             try:
-                cursor.execute(f"CREATE USER IF NOT EXISTS '{db_user}'@'localhost' IDENTIFIED BY '{db_password}'")
-            except Error:
-                # Fallback for older MySQL versions
+                statements = [
+                    literal_backslashes,
+                    create_database,
+                    f"CREATE USER IF NOT EXISTS '{db_user}'@'localhost' IDENTIFIED BY '{password}'",
+                    grant,
+                    "FLUSH PRIVILEGES",
+                ]
+                for _ in cursor.execute(";".join(statements), multi=True):
+                    pass
+            except Error as e:
+                # Older MySQL versions don't know CREATE USER IF NOT EXISTS; any
+                # other error goes to the handler below
+                if e.errno != errorcode.ER_PARSE_ERROR:
+                    raise
+                    
+                # Fallback for older MySQL versions, one statement at a time
+                cursor.execute(literal_backslashes)
+                cursor.execute(create_database)
                 try:
                     cursor.execute(f"SELECT User FROM mysql.user WHERE User = '{db_user}' AND Host = 'localhost'")
                     if not cursor.fetchone():
-                        cursor.execute(f"CREATE USER '{db_user}'@'localhost' IDENTIFIED BY '{db_password}'")
+                        cursor.execute(f"CREATE USER '{db_user}'@'localhost' IDENTIFIED BY '{password}'")
                 except Error as e:
                     print(f"Error creating user: {e}")
                     return False
-            
+                cursor.execute(grant)
+                cursor.execute("FLUSH PRIVILEGES")
+                
+            print(f"Database '{db_name}' created or already exists.")
             print(f"User '{db_user}' created or already exists.")
-            
-            # Grant privileges
-            cursor.execute(f"GRANT ALL PRIVILEGES ON {db_name}.* TO '{db_user}'@'localhost'")
-            cursor.execute("FLUSH PRIVILEGES")
             print(f"Privileges granted to user '{db_user}'.")
             
-            # Create a .env file with database configuration
-            env_content = f"""
-# Database configuration
-DB_HOST={host}
-DB_USER={db_user}
-DB_PASSWORD={db_password}
-DB_NAME={db_name}
-DB_PORT={port}
-
-# Filesystem paths
-MOUNT_POINT=~/fuse_mount
-STORAGE_PATH=~/fuse_storage
-
-# Google Drive API
-GOOGLE_CREDENTIALS_FILE=credentials.json
-GOOGLE_TOKEN_FILE=token.json
-
-# LFU Cache settings
-CACHE_SIZE=100
-CACHE_DIR=~/fuse_storage/cache
-
-# Sync settings
-SYNC_INTERVAL=300
-MAX_SYNC_RETRIES=3
-
-# Security settings
-ENCRYPTION_ENABLED=False
-ENCRYPTION_KEY=
-
-# Logging configuration
-LOG_LEVEL=INFO
-LOG_FILE=fuse_fs.log
-
-# Performance tuning
-BUFFER_SIZE=4096
-"""
+            # Create a .env file with database configuration, readable only by
+            # the owner as it holds the database password
+            env_content = _ENV_TEMPLATE.substitute(
+                host=host,
+                db_user=db_user,
+                db_password=db_password,
+                db_name=db_name,
+                port=port
+            ).encode('utf-8')
             
-            with open(".env", "w") as f:
-                f.write(env_content)
+            fd = os.open(env_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                # The open mode only applies to a new file, so tighten an existing one too
+                os.fchmod(fd, 0o600)
+                os.write(fd, env_content)
+            finally:
+                os.close(fd)
             
-            print("Created .env file with database configuration.")
+            print(f"Created {env_path} file with database configuration.")
             
             return True
             
     except Error as e:
         print(f"Error: {e}")
         return False
-    finally:
-        if 'connection' in locals() and connection.is_connected():
-            cursor.close()
-            connection.close()
+
+def setup_databases(host, port, admin_user, admin_password, tenants):
+    """
+    Set up a database and user for each of several tenants on one server.
+    
+    Args:
+        tenants: List of (db_name, db_user, db_password, env_path) tuples
+        
+    Returns:
+        A list with the result of each tenant's setup, in order
+    """
+    # Each tenant's statements run in order on one connection; tenants are
+    # independent, so from three on they run in parallel on pooled connections
+    workers = min(_ADMIN_POOL_SIZE, len(tenants)) if len(tenants) >= 3 else 1
+    get_admin_pool(host, port, admin_user, admin_password, size=workers)
+    
+    def setup_one(tenant):
+        db_name, db_user, db_password, env_path = tenant
+        return setup_database(host, port, admin_user, admin_password, db_name, db_user, db_password, env_path)
+        
+    if workers == 1:
+        return [setup_one(tenant) for tenant in tenants]
+        
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(setup_one, tenants))
 
 def main():
     """Main entry point."""
     args = parse_args()
+    import getpass
     
     print("FUSE Virtual File System - Database Setup")
     print("----------------------------------------")
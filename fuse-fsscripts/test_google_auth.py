@@ -4,6 +4,11 @@ Test Google Drive authentication with credentials.json
 """
 import os
 import sys
+import json
+import time
+import functools
+import threading
+from datetime import datetime
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -15,31 +20,102 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 # Use the same scopes as in your config file
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-def test_google_drive_auth():
-    """Test Google Drive authentication and list files."""
-    print("Testing Google Drive authentication...")
-    
-    credentials_file = 'credentials.json'
-    token_file = 'token.json'
-    
+# Credentials are refreshed ahead of expiry once they're this close to it (seconds)
+REFRESH_WINDOW = 300
+
+# Live credentials from an earlier call, as (credentials, reuse until on the monotonic clock)
+_TOKEN_CACHE = None
+# How long to reuse credentials that don't say when they expire (seconds)
+_CREDS_CACHE_TTL = 55 * 60
+
+# The background refresher wakes this often to check the cached credentials (seconds)
+REFRESHER_INTERVAL = 60
+_REFRESHER = None
+_REFRESHER_LOCK = threading.Lock()
+
+# Drive list requests already built, by id of their credentials, as (credentials, request)
+_REQUEST_CACHE = {}
+
+@functools.lru_cache(maxsize=4)
+def _parse_token(token_file, mtime_ns):
+    """Parse a token file; the mtime in the key makes a changed file parse again."""
+    with open(token_file, 'rb') as f:
+        return json.load(f)
+
+def _reuse_until(creds):
+    """Get the monotonic time until which credentials can be reused without checking them."""
+    if not creds.expiry:
+        return time.monotonic() + _CREDS_CACHE_TTL
+    remaining = (creds.expiry - datetime.utcnow()).total_seconds()
+    return time.monotonic() + max(60, remaining - REFRESH_WINDOW)
+
+def _save_token(creds, token_file):
+    """Save credentials to the token file, owner-only and replacing the old token in one step."""
+    # Written aside first so a crash can't leave the token half written
+    tmp_file = token_file + '.tmp'
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+        os.write(fd, creds.to_json().encode())
+    finally:
+        os.close(fd)
+    os.replace(tmp_file, token_file)
+
+def _refresher(token_file):
+    """Refresh the cached credentials in the background as they come close to expiring."""
+    global _TOKEN_CACHE
+    while True:
+        time.sleep(REFRESHER_INTERVAL)
+        cached = _TOKEN_CACHE
+        if not cached:
+            continue
+        creds = cached[0]
+        if not (creds.refresh_token and creds.expiry
+                and (creds.expiry - datetime.utcnow()).total_seconds() < REFRESH_WINDOW):
+            continue
+        try:
+            creds.refresh(Request())
+            _save_token(creds, token_file)
+            _TOKEN_CACHE = (creds, _reuse_until(creds))
+        except Exception as e:
+            print(f"Error refreshing credentials in the background: {e}")
+
+def _start_refresher(token_file):
+    """Start the background refresher, once per process."""
+    global _REFRESHER
+    with _REFRESHER_LOCK:
+        if _REFRESHER is None:
+            _REFRESHER = threading.Thread(target=_refresher, args=(token_file,), daemon=True)
+            _REFRESHER.start()
+
+def _load_credentials(credentials_file, token_file):
+    """Load credentials from the token file, refreshing them or running the OAuth flow as needed."""
     # Check if credentials file exists
     if not os.path.exists(credentials_file):
         print(f"Error: Credentials file '{credentials_file}' not found")
-        return False
-    
-    creds = None
+        return None
     
     # Check if token.json exists
+    creds = None
     if os.path.exists(token_file):
         try:
             creds = Credentials.from_authorized_user_info(
-                info=eval(open(token_file, 'r').read()),
+                info=dict(_parse_token(token_file, os.stat(token_file).st_mtime_ns)),
                 scopes=SCOPES
             )
             print("Found existing token.json file")
         except Exception as e:
             print(f"Error loading credentials from token file: {e}")
     
+    # Refresh ahead of expiry rather than waiting for an API call to fail
+    if (creds and creds.valid and creds.refresh_token and creds.expiry
+            and (creds.expiry - datetime.utcnow()).total_seconds() < REFRESH_WINDOW):
+        try:
+            print("Refreshing credentials that are about to expire...")
+            creds.refresh(Request())
+        except Exception as e:
+            print(f"Error refreshing credentials: {e}")
+    
     # If credentials don't exist or are invalid, get new ones
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -60,22 +136,59 @@ def test_google_drive_auth():
                 print("OAuth flow completed successfully")
                 
                 # Save the credentials for the next run
-                with open(token_file, 'w') as token:
-                    token.write(str(creds.to_json()))
+                _save_token(creds, token_file)
                 print(f"Saved credentials to {token_file}")
             except Exception as e:
                 print(f"Error during OAuth flow: {e}")
-                return False
+                return None
+    
+    return creds
+
+def _get_list_request(creds):
+    """
+    Get a request listing a few Drive files with the credentials.
+    
+    The request is built once per credentials and executed again on each call,
+    reusing its service's HTTP connection.
+    """
+    cached = _REQUEST_CACHE.get(id(creds))
+    # The credentials are kept alongside so a recycled id can't match a different object
+    if cached and cached[0] is creds:
+        return cached[1]
+    service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+    # Only the fields that get printed; the listing is never paginated
+    list_request = service.files().list(
+        pageSize=10, fields="files(id,name)", q="trashed = false", spaces='drive')
+    _REQUEST_CACHE[id(creds)] = (creds, list_request)
+    return list_request
+
+def test_google_drive_auth():
+    """Test Google Drive authentication and list files."""
+    global _TOKEN_CACHE
+    print("Testing Google Drive authentication...")
+    
+    # Reuse the credentials from an earlier call while they're fresh, without touching any files
+    if _TOKEN_CACHE and time.monotonic() < _TOKEN_CACHE[1]:
+        creds = _TOKEN_CACHE[0]
+        print("Using cached credentials")
+    else:
+        creds = _load_credentials('credentials.json', 'token.json')
+        if not creds:
+            return False
+        _TOKEN_CACHE = (creds, _reuse_until(creds))
+        
+        # Keep the cached credentials fresh from here on, so later calls don't
+        # wait on a refresh; the inline refresh above stays as the fallback
+        _start_refresher('token.json')
     
     try:
-        # Build the service
-        service = build('drive', 'v3', credentials=creds)
+        # Build the service and its list request
+        list_request = _get_list_request(creds)
         print("Successfully authenticated with Google Drive")
         
         # List files to test the connection
         print("\nListing files from your Google Drive:")
-        results = service.files().list(
-            pageSize=10, fields="nextPageToken, files(id, name)").execute()
+        results = list_request.execute()
         items = results.get('files', [])
         
         if not items:
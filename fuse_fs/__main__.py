@@ -15,8 +15,10 @@ from fuse_fs.utils.logger import setup_logging
 from fuse_fs.core.filesystem import mount_filesystem, FuseFS
 from fuse_fs.cloud.google_drive import GoogleDriveSync
 
-def parse_args():
-    """Parse command line arguments."""
+_IS_WINDOWS = sys.platform == 'win32'
+
+def _build_parser():
+    """Build the command line argument parser."""
     parser = argparse.ArgumentParser(
         description="FUSE Virtual File System with Metadata Storage, Cloud Sync, and LFU Caching"
     )
@@ -57,7 +59,14 @@ def parse_args():
         action="store_true"
     )
     
-    return parser.parse_args()
+    return parser
+
+# Built once at import so parse_args is a single call
+_PARSER = _build_parser()
+
+def parse_args():
+    """Parse command line arguments."""
+    return _PARSER.parse_args()
 
 def setup_signal_handlers(sync_manager=None):
     """Set up signal handlers for graceful shutdown."""
@@ -84,32 +93,26 @@ def main():
     os.makedirs(args.storage, exist_ok=True)
     
     # Check if mount point is already mounted and try to unmount it
-    mount_point_exists = os.path.exists(args.mount)
-    if mount_point_exists:
+    # (ismount is False for a missing path, so no separate exists() probe is needed)
+    logger.info(f"Checking if {args.mount} is already mounted")
+    if os.path.ismount(args.mount):
         try:
             import subprocess
-            logger.info(f"Checking if {args.mount} is already mounted")
-            # Check if it's a mount point
-            is_mounted = os.path.ismount(args.mount)
-            if is_mounted:
-                logger.warning(f"Mount point {args.mount} is already mounted, attempting to unmount")
-                if sys.platform == 'win32':
-                    # Windows unmount
-                    subprocess.run(['taskkill', '/f', '/im', 'winfsp-x64.exe'], stderr=subprocess.PIPE)
-                else:
-                    # Linux/macOS unmount
-                    subprocess.run(['fusermount', '-u', args.mount], stderr=subprocess.PIPE)
-                    # If the above fails, try force unmount (requires sudo)
-                    if os.path.ismount(args.mount):
-                        logger.warning("Attempting force unmount (may require sudo)")
-                        subprocess.run(['sudo', 'umount', '-l', args.mount], stderr=subprocess.PIPE)
+            logger.warning(f"Mount point {args.mount} is already mounted, attempting to unmount")
+            if _IS_WINDOWS:
+                # Windows unmount
+                subprocess.run(['taskkill', '/f', '/im', 'winfsp-x64.exe'], stderr=subprocess.PIPE)
+            else:
+                # Linux/macOS unmount
+                subprocess.run(['fusermount', '-u', args.mount], stderr=subprocess.PIPE)
+                # If the above fails, try force unmount (requires sudo)
+                if os.path.ismount(args.mount):
+                    logger.warning("Attempting force unmount (may require sudo)")
+                    subprocess.run(['sudo', 'umount', '-l', args.mount], stderr=subprocess.PIPE)
         except Exception as e:
             logger.error(f"Failed to unmount existing mount point: {e}")
             logger.warning("You may need to manually unmount the filesystem")
     
-    # Create mount point directory if it doesn't exist
-    os.makedirs(args.mount, exist_ok=True)
-    
     # Initialize Google Drive sync if enabled
     sync_manager = None
     if not args.no_sync:
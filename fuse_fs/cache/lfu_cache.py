@@ -2,16 +2,68 @@
 LFU (Least Frequently Used) Cache implementation for FUSE filesystem.
 """
 import os
+import sys
+import json
+import mmap
+import stat
 import time
+import errno
 import shutil
 import logging
+import heapq
 import hashlib
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from fuse_fs import config
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of bytes handed to a single copy_file_range/sendfile call
+_COPY_CHUNK_SIZE = 1024 * 1024 * 1024
+
+# Name of the persistent index file inside the cache directory
+_INDEX_FILE = "index.json"
+
+# Errors indicating a copy primitive is unsupported for the given files
+_COPY_FALLBACK_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+# Upper bound on threads used to remove cache files in clear()
+_CLEAR_WORKERS = 32
+
+def _valid_index_entry(info):
+    """Check that an index entry has the shape save_index writes."""
+    return (isinstance(info, dict)
+            and isinstance(info.get('cache_path'), str)
+            and type(info.get('size')) is int
+            and type(info.get('frequency')) is int and info['frequency'] >= 0
+            and (info.get('attrs') is None or isinstance(info['attrs'], dict)))
+
+class CacheEntry:
+    """State for a single cached file."""
+    
+    __slots__ = ('cache_path', 'size', 'freq', 'attrs', 'fd', 'mm', 'readers', 'close_pending')
+    
+    def __init__(self, cache_path, size, freq=1, attrs=None):
+        self.cache_path = cache_path
+        self.size = size
+        self.freq = freq
+        
+        # File attributes, kept ready-built because FUSE getattr returns a dict
+        # on every call; a columnar layout would have to rebuild it each time
+        self.attrs = attrs
+        
+        # Read descriptor, opened on first read and kept while recently used,
+        # and for large files a read-only mapping
+        self.fd = None
+        self.mm = None
+        
+        # Reads in progress outside the cache lock; closing the descriptor is
+        # deferred until the last of them is done
+        self.readers = 0
+        self.close_pending = False
+
 class LFUCache:
     """
     LFU (Least Frequently Used) Cache for the FUSE filesystem.
@@ -28,21 +80,39 @@ class LFUCache:
         # Create cache directory if it doesn't exist
         os.makedirs(self.cache_dir, exist_ok=True)
         
-        # Dictionary to track frequency of each file
-        self.frequency = {}
+        # Dictionary holding all state for each cached file (path -> CacheEntry)
+        self.entries = {}
+        
+        # Frequency buckets (freq -> ordered paths, oldest first) for O(1) eviction
+        self.freq_buckets = {}
+        
+        # Lowest frequency currently present in the buckets
+        self.min_freq = 0
         
-        # Dictionary to store cached file data (path -> cached_file_path)
-        self.cache = {}
+        # Heap of bucket frequencies (may hold stale ones) to find the next min_freq
+        self.freq_heap = []
         
-        # Dictionary to store file attributes (path -> attr)
-        self.attrs = {}
+        # Entries with an open descriptor, least recently read first, so the
+        # cache never holds more than CACHE_MAX_OPEN_FILES descriptors
+        self.open_entries = OrderedDict()
         
-        # Dictionary to map cache file paths to original paths
-        self.cache_map = {}
+        # Files currently being copied, with the size reserved for them and the
+        # source's mtime when the copy started (path -> (size, mtime_ns))
+        self.pending = {}
+        
+        # Pending copies invalidated while in flight; they're dropped when they
+        # finish instead of being registered with outdated content
+        self.stale = set()
         
         # Total size of cached files
         self.total_size = 0
         
+        # Protects the tracking dictionaries against concurrent FUSE requests
+        self.lock = threading.RLock()
+        
+        # Background workers for add_async; threads are only started on first use
+        self.copy_executor = ThreadPoolExecutor(max_workers=config.CACHE_BACKGROUND_WORKERS)
+        
         # Load existing cache files if any
         self._load_existing_cache()
         
@@ -53,197 +123,588 @@ class LFUCache:
         if not os.path.exists(self.cache_dir):
             return
             
-        for filename in os.listdir(self.cache_dir):
-            if filename.startswith("cache_"):
-                cache_path = os.path.join(self.cache_dir, filename)
-                try:
-                    # Get file size
-                    size = os.path.getsize(cache_path)
-                    
-                    # We don't know the original path, so we'll use the cache file
-                    # path as a placeholder until it's accessed properly
-                    self.frequency[cache_path] = 0
-                    self.cache[cache_path] = cache_path
-                    self.cache_map[cache_path] = cache_path
-                    self.total_size += size
-                    
-                    logger.debug(f"Loaded existing cache file: {cache_path} ({size} bytes)")
-                except Exception as e:
-                    logger.error(f"Error loading cache file {cache_path}: {e}")
-    
-    def _get_cache_path(self, path):
-        """Generate a cache file path for a given file path."""
-        # Create a hash of the path to avoid any path separation issues
-        path_hash = hashlib.md5(path.encode()).hexdigest()
-        return os.path.join(self.cache_dir, f"cache_{path_hash}")
+        index = self._load_index()
+        
+        # A single directory pass tells us which cache files are still present
+        with os.scandir(self.cache_dir) as it:
+            cache_files = {entry.name: entry for entry in it if entry.name.startswith("cache_")}
+        
+        # Restore indexed entries whose cache file survived, in eviction order.
+        # Malformed entries are skipped, leaving their files to the scan below
+        for path, info in index.items():
+            if not _valid_index_entry(info):
+                logger.warning(f"Ignoring malformed cache index entry for {path}")
+                continue
+                
+            filename = os.path.basename(info['cache_path'])
+            file_entry = cache_files.pop(filename, None)
+            if file_entry is None:
+                continue
+                
+            cache_path = os.path.join(self.cache_dir, filename)
+            try:
+                # Account for the file as it is on disk, not as the index recorded it
+                size = file_entry.stat().st_size
+            except OSError as e:
+                logger.error(f"Error loading cache file {cache_path}: {e}")
+                continue
+                
+            self._link(sys.intern(path), CacheEntry(cache_path, size, info['frequency'], info['attrs']))
+            self.total_size += size
+                
+        if index:
+            logger.debug("Loaded %s cache entries from index", len(self.entries))
+        
+        # Fall back to scanning files the index doesn't know about
+        for filename, entry in cache_files.items():
+            cache_path = os.path.join(self.cache_dir, filename)
+            try:
+                # Get file size
+                size = entry.stat().st_size
+                
+                # We don't know the original path, so we'll use the cache file
+                # path as a placeholder until it's accessed properly
+                self._link(cache_path, CacheEntry(cache_path, size, freq=0))
+                self.total_size += size
+                
+                logger.debug("Loaded existing cache file: %s (%s bytes)", cache_path, size)
+            except Exception as e:
+                logger.error(f"Error loading cache file {cache_path}: {e}")
+                
+        # The cache may have been left larger than this run allows
+        while self.total_size > self.max_size and self.entries:
+            self._evict()
     
-    def _evict(self):
-        """Evict the least frequently used file from the cache."""
-        if not self.frequency:
-            return
+    def _get_index_path(self):
+        """Get the path of the persistent cache index."""
+        return os.path.join(self.cache_dir, _INDEX_FILE)
+    
+    def _load_index(self):
+        """Load the cache index written by save_index, if there is one."""
+        index_path = self._get_index_path()
+        
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading cache index {index_path}: {e}")
+            index = {}
+            
+        if not isinstance(index, dict):
+            logger.error(f"Ignoring malformed cache index {index_path}")
+            index = {}
+            
+        # The index only describes the cache as it was at shutdown, so remove it
+        # to avoid restoring stale entries if this run doesn't exit cleanly
+        try:
+            os.remove(index_path)
+        except OSError as e:
+            logger.error(f"Error removing cache index {index_path}: {e}")
             
-        # Find the item with the lowest frequency
-        min_freq = min(self.frequency.values())
+        return index
+    
+    def save_index(self):
+        """Persist the cache index so the next start can skip rescanning the cache."""
+        with self.lock:
+            # Walk the buckets lowest frequency first so eviction order survives a restart
+            index = {
+                path: {
+                    'cache_path': entry.cache_path,
+                    'size': entry.size,
+                    'frequency': entry.freq,
+                    'attrs': entry.attrs,
+                }
+                for freq in sorted(self.freq_buckets)
+                for path, entry in self.freq_buckets[freq].items()
+            }
         
-        # Get all files with the minimum frequency
-        min_freq_files = [p for p, f in self.frequency.items() if f == min_freq]
+        index_path = self._get_index_path()
+        tmp_path = index_path + '.tmp'
         
-        # If multiple files have the same frequency, remove the oldest one
-        path_to_remove = min_freq_files[0]
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+            logger.info(f"Saved cache index with {len(index)} entries")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving cache index {index_path}: {e}")
+            return False
+    
+    def _get_cache_path(self, encoded_path):
+        """Generate a cache file path for a given UTF-8 encoded file path."""
+        # Create a hash of the path to avoid any path separation issues.
+        # The name only needs to be unique, not cryptographically strong, so use
+        # the faster BLAKE2b with a 128-bit digest (same length as the old MD5)
+        path_hash = hashlib.blake2b(encoded_path, digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"cache_{path_hash}")
+    
+    def _copy_file(self, source_path, cache_path):
+        """Copy a file into the cache, keeping the data inside the kernel when possible."""
+        src_fd = os.open(source_path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            dst_fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                use_copy_file_range = hasattr(os, 'copy_file_range')
+                use_sendfile = hasattr(os, 'sendfile')
+                
+                while use_copy_file_range or use_sendfile:
+                    try:
+                        if use_copy_file_range:
+                            copied = os.copy_file_range(src_fd, dst_fd, _COPY_CHUNK_SIZE)
+                        else:
+                            copied = os.sendfile(dst_fd, src_fd, None, _COPY_CHUNK_SIZE)
+                    except OSError as e:
+                        # Fall back to the next strategy if the kernel or filesystem
+                        # does not support this one and nothing has been copied yet
+                        if e.errno not in _COPY_FALLBACK_ERRNOS or os.lseek(dst_fd, 0, os.SEEK_CUR):
+                            raise
+                        if use_copy_file_range:
+                            use_copy_file_range = False
+                        else:
+                            use_sendfile = False
+                        continue
+                        
+                    if not copied:
+                        break
+                else:
+                    # No zero-copy primitive available, copy through user space
+                    with open(source_path, 'rb') as f_in, open(dst_fd, 'wb', closefd=False) as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+            
+        # Preserve permission bits and timestamps like shutil.copy2
+        shutil.copystat(source_path, cache_path)
+    
+    def _open_fd(self, path, entry):
+        """Open a read descriptor for a cached file, closing the least recently read one if at the limit."""
+        while len(self.open_entries) >= max(config.CACHE_MAX_OPEN_FILES, 1):
+            self._close_fd(*next(iter(self.open_entries.items())))
+            
+        fd = os.open(entry.cache_path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
         
-        # Get the cache path
-        cache_path = self.cache.get(path_to_remove)
+        # Cached files are mostly read at random offsets by FUSE
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+            
+        entry.fd = fd
         
-        if cache_path and os.path.exists(cache_path):
-            # Update total size
-            self.total_size -= os.path.getsize(cache_path)
+        # Map large files so reads are served straight from the page cache
+        if entry.size >= config.CACHE_MMAP_THRESHOLD:
+            try:
+                entry.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                if hasattr(entry.mm, 'madvise'):
+                    entry.mm.madvise(mmap.MADV_RANDOM)
+            except (OSError, ValueError) as e:
+                logger.debug("Falling back to pread for %s: %s", entry.cache_path, e)
+                
+        self.open_entries[path] = entry
+        return fd
+    
+    def _close_fd(self, path, entry):
+        """Close the read descriptor for a cached file if one is open, once no read is using it."""
+        # The path may have been cached again since, with an entry of its own
+        if self.open_entries.get(path) is entry:
+            del self.open_entries[path]
+        if entry.readers:
+            entry.close_pending = True
+            return
             
-            # Remove the file from the cache
+        entry.close_pending = False
+        if entry.mm is not None:
+            entry.mm.close()
+            entry.mm = None
+            
+        if entry.fd is not None:
             try:
-                os.remove(cache_path)
-                logger.debug(f"Evicted file from cache: {path_to_remove}")
-            except Exception as e:
-                logger.error(f"Error removing cache file {cache_path}: {e}")
+                os.close(entry.fd)
+            except OSError as e:
+                logger.error(f"Error closing cache descriptor for {path}: {e}")
+            entry.fd = None
+    
+    def _get_bucket(self, freq):
+        """Get the bucket for a frequency, creating it if needed."""
+        bucket = self.freq_buckets.get(freq)
+        if bucket is None:
+            bucket = self.freq_buckets[freq] = OrderedDict()
+            heapq.heappush(self.freq_heap, freq)
+            
+            # Rebuild once stale frequencies dominate so the heap stays bounded
+            if len(self.freq_heap) > 2 * len(self.freq_buckets) + 16:
+                self.freq_heap = list(self.freq_buckets)
+                heapq.heapify(self.freq_heap)
+        return bucket
+    
+    def _next_min_freq(self):
+        """Find the lowest frequency that still has a bucket."""
+        # Frequencies whose bucket has since emptied are dropped lazily
+        while self.freq_heap[0] not in self.freq_buckets:
+            heapq.heappop(self.freq_heap)
+        return self.freq_heap[0]
+    
+    def _link(self, path, entry):
+        """Start tracking an entry in the bucket for its frequency."""
+        if not self.entries or entry.freq < self.min_freq:
+            self.min_freq = entry.freq
+            
+        self.entries[path] = entry
+        self._get_bucket(entry.freq)[path] = entry
+    
+    def _unlink(self, path, entry):
+        """Stop tracking an entry and release its descriptor and cache file."""
+        del self.entries[path]
         
-        # Remove from tracking dictionaries
-        if path_to_remove in self.frequency:
-            del self.frequency[path_to_remove]
-        if path_to_remove in self.cache:
-            cache_file = self.cache[path_to_remove]
-            del self.cache[path_to_remove]
+        bucket = self.freq_buckets[entry.freq]
+        del bucket[path]
+        if not bucket:
+            del self.freq_buckets[entry.freq]
+            if self.min_freq == entry.freq and self.freq_buckets:
+                self.min_freq = self._next_min_freq()
+        
+        # Update total size from the size recorded at add time
+        self.total_size -= entry.size
+        self._close_fd(path, entry)
+        
+        # Remove the file from the cache
+        return self._remove_cache_file(entry.cache_path)
+    
+    def _remove_cache_file(self, cache_path):
+        """Remove a cache file, returning whether it was there to remove."""
+        try:
+            os.remove(cache_path)
+            return True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error removing cache file {cache_path}: {e}")
+        return False
+    
+    def _increment_frequency(self, path, entry):
+        """Move an entry from its current frequency bucket to the next one."""
+        freq = entry.freq
+        bucket = self.freq_buckets[freq]
+        del bucket[path]
+        if not bucket:
+            del self.freq_buckets[freq]
+            if self.min_freq == freq:
+                self.min_freq = freq + 1
+        
+        entry.freq = freq + 1
+        self._get_bucket(freq + 1)[path] = entry
+    
+    def _evict(self):
+        """Evict the least frequently used file from the cache."""
+        if not self.entries:
+            return
             
-            # Remove from cache map
-            if cache_file in self.cache_map:
-                del self.cache_map[cache_file]
-                
-        # Remove from attrs if present
-        if path_to_remove in self.attrs:
-            del self.attrs[path_to_remove]
+        # The oldest path in the lowest frequency bucket goes first; min_freq is
+        # maintained incrementally, so eviction never scans the frequencies
+        path_to_remove, entry = next(iter(self.freq_buckets[self.min_freq].items()))
+        if self._unlink(path_to_remove, entry):
+            logger.debug("Evicted file from cache: %s", path_to_remove)
     
     def has(self, path):
         """Check if a file is in the cache."""
-        return path in self.cache and os.path.exists(self.cache[path])
+        path = sys.intern(path)
+        entry = self.entries.get(path)
+        return entry is not None and os.path.exists(entry.cache_path)
     
-    def add(self, path, source_path):
-        """Add a file to the cache."""
-        if not os.path.exists(source_path):
+    def _reserve(self, path, source_path):
+        """
+        Make room for a file and reserve its size in the cache.
+        
+        Returns:
+            A (cache_path, file_size) tuple, or None if the file can't be cached
+        """
+        try:
+            st = os.stat(source_path)
+        except FileNotFoundError:
             logger.error(f"Cannot add nonexistent file to cache: {source_path}")
-            return False
+            return None
             
         # Check file size
-        file_size = os.path.getsize(source_path)
+        file_size = st.st_size
         
         # If the file is too big (more than half the cache size), don't cache it
         if file_size > (self.max_size / 2):
             logger.warning(f"File too large to cache: {path} ({file_size} bytes)")
-            return False
-        
-        # If we need to make space, evict files
-        while self.total_size + file_size > self.max_size and self.frequency:
-            self._evict()
-        
-        # Get cache file path
-        cache_path = self._get_cache_path(path)
+            return None
         
-        # Copy the file to the cache
-        try:
-            shutil.copy2(source_path, cache_path)
+        with self.lock:
+            # Another thread is already copying this file into the cache
+            if path in self.pending:
+                logger.debug("File is already being added to cache: %s", path)
+                return None
+                
+            # Drop any previous copy of this file before making room
+            self.invalidate(path)
+            
+            # If we need to make space, evict files
+            while self.total_size + file_size > self.max_size and self.entries:
+                self._evict()
             
-            # Update tracking dictionaries
-            self.frequency[path] = 1
-            self.cache[path] = cache_path
-            self.cache_map[cache_path] = path
             self.total_size += file_size
+            self.pending[path] = (file_size, st.st_mtime_ns)
             
-            # Get file attributes
-            st = os.lstat(source_path)
-            attr = {key: getattr(st, key) for key in ('st_atime', 'st_ctime',
-                    'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid')}
-            self.attrs[path] = attr
+        return self._get_cache_path(path.encode('utf-8')), file_size
+    
+    def _release(self, path, cache_path, file_size):
+        """Give back the space reserved for a file whose copy failed."""
+        with self.lock:
+            if self.pending.pop(path, None) is not None:
+                self.total_size -= file_size
+            self.stale.discard(path)
+                
+            # Don't leave a partial copy behind
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error removing cache file {cache_path}: {e}")
+    
+    def _register(self, path, source_path, cache_path, file_size):
+        """Start tracking a file that has been copied into the cache."""
+        # Get file attributes, and the stat the reservation was made with
+        st = os.lstat(source_path)
+        current = os.stat(source_path) if stat.S_ISLNK(st.st_mode) else st
+        attr = {
+            'st_atime': st.st_atime,
+            'st_ctime': st.st_ctime,
+            'st_gid': st.st_gid,
+            'st_mode': st.st_mode,
+            'st_mtime': st.st_mtime,
+            'st_nlink': st.st_nlink,
+            'st_size': st.st_size,
+            'st_uid': st.st_uid,
+        }
+        
+        with self.lock:
+            # The cache was cleared while the copy was in flight
+            reserved = self.pending.get(path)
+            if reserved is None:
+                raise RuntimeError(f"Cache reservation for {path} was dropped")
+                
+            # The file was written while the copy was in flight, so the copy
+            # may hold old data; _release gives back the reservation
+            if path in self.stale or reserved != (current.st_size, current.st_mtime_ns):
+                raise RuntimeError(f"{path} changed while it was being cached")
+                
+            del self.pending[path]
+            entry = CacheEntry(cache_path, file_size, attrs=attr)
+            self._link(path, entry)
+    
+    def add(self, path, source_path):
+        """Add a file to the cache."""
+        # Interned keys let the tracking dictionaries compare by identity
+        path = sys.intern(path)
+        reservation = self._reserve(path, source_path)
+        if reservation is None:
+            return False
             
-            logger.debug(f"Added file to cache: {path} ({file_size} bytes)")
+        return self._populate(path, source_path, *reservation)
+    
+    def add_async(self, path, source_path):
+        """
+        Add a file to the cache on a background thread.
+        
+        Until the copy finishes the file is not reported as cached, so callers
+        keep reading from the source in the meantime.
+        
+        Returns:
+            A Future resolving to whether the file was cached, or None if the
+            file can't be cached
+        """
+        path = sys.intern(path)
+        reservation = self._reserve(path, source_path)
+        if reservation is None:
+            return None
+            
+        try:
+            return self.copy_executor.submit(self._populate, path, source_path, *reservation)
+        except RuntimeError as e:
+            # The executor has been shut down for unmount
+            self._release(path, *reservation)
+            logger.debug("Not caching %s in the background: %s", path, e)
+            return None
+    
+    def _populate(self, path, source_path, cache_path, file_size):
+        """Copy a file into its reserved cache slot and start tracking it."""
+        try:
+            self._copy_file(source_path, cache_path)
+            self._register(path, source_path, cache_path, file_size)
+            
+            logger.debug("Added file to cache: %s (%s bytes)", path, file_size)
             return True
             
         except Exception as e:
+            self._release(path, cache_path, file_size)
             logger.error(f"Error adding file to cache: {e}")
             return False
     
-    def read(self, path, length, offset):
-        """Read data from a cached file."""
-        if not self.has(path):
-            return None
+    def add_many(self, items):
+        """
+        Add several files to the cache, copying them concurrently.
+        
+        Args:
+            items: Iterable of (path, source_path) tuples
             
-        # Increment access frequency
-        self.frequency[path] = self.frequency.get(path, 0) + 1
+        Returns:
+            Dictionary mapping each path to whether it was cached
+        """
+        # Later entries for the same path win, as with repeated add() calls
+        items = {sys.intern(path): source_path for path, source_path in items}
+        results = {path: False for path in items}
         
-        # Get cache file path
-        cache_path = self.cache[path]
+        # Space is reserved up front so the concurrent copies can't overfill the cache
+        reservations = []
+        for path, source_path in items.items():
+            reservation = self._reserve(path, source_path)
+            if reservation is not None:
+                reservations.append((path, source_path) + reservation)
+                
+        if not reservations:
+            return results
+            
+        workers = min(config.CACHE_COPY_WORKERS, len(reservations))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._copy_file, source_path, cache_path)
+                       for _, source_path, cache_path, _ in reservations]
         
+        for (path, source_path, cache_path, file_size), future in zip(reservations, futures):
+            try:
+                future.result()
+                self._register(path, source_path, cache_path, file_size)
+                results[path] = True
+                logger.debug("Added file to cache: %s (%s bytes)", path, file_size)
+            except Exception as e:
+                self._release(path, cache_path, file_size)
+                logger.error(f"Error adding file to cache: {e}")
+                
+        return results
+    
+    def read(self, path, length, offset):
+        """Read data from a cached file."""
+        # Only the lookup and bookkeeping take the lock. The entry counts the
+        # read while it's in progress, so eviction can't close the descriptor
+        # under it, and a reused descriptor number can't serve another file's data
+        path = sys.intern(path)
+        with self.lock:
+            # No stat of the cache file per read; one that has disappeared
+            # fails to open below and its entry is dropped
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+                
+            # Increment access frequency
+            self._increment_frequency(path, entry)
+            
+            try:
+                fd = entry.fd
+                if fd is None:
+                    fd = self._open_fd(path, entry)
+                elif entry.close_pending:
+                    # Still open for another read, so keep it instead
+                    entry.close_pending = False
+                    self.open_entries[path] = entry
+                else:
+                    self.open_entries.move_to_end(path)
+            except FileNotFoundError:
+                logger.debug("Cache file for %s has disappeared", path)
+                self._unlink(path, entry)
+                return None
+            except Exception as e:
+                logger.error(f"Error reading from cache: {e}")
+                return None
+                
+            # The descriptor stays open until this read is done
+            entry.readers += 1
+            mm = entry.mm
+            
+        # Read outside the lock so FUSE threads only serialize on the bookkeeping
         try:
-            with open(cache_path, 'rb') as f:
-                f.seek(offset)
-                return f.read(length)
+            if mm is not None:
+                return mm[offset:offset + length]
+            return os.pread(fd, length, offset)
         except Exception as e:
             logger.error(f"Error reading from cache: {e}")
             return None
+        finally:
+            with self.lock:
+                entry.readers -= 1
+                if not entry.readers and entry.close_pending:
+                    self._close_fd(path, entry)
     
     def invalidate(self, path):
-        """Invalidate a file in the cache."""
-        if not self.has(path):
-            return
-            
-        # Get cache file path
-        cache_path = self.cache[path]
+        """
+        Invalidate a file in the cache.
         
-        if os.path.exists(cache_path):
-            # Update total size
-            self.total_size -= os.path.getsize(cache_path)
-            
-            # Remove the file from the cache
-            try:
-                os.remove(cache_path)
-                logger.debug(f"Invalidated file in cache: {path}")
-            except Exception as e:
-                logger.error(f"Error removing cache file {cache_path}: {e}")
+        Must be called whenever the file's content changes (write, truncate,
+        unlink, rename), including while it is still being copied in.
+        """
+        path = sys.intern(path)
         
-        # Remove from tracking dictionaries
-        if path in self.frequency:
-            del self.frequency[path]
-        if path in self.cache:
-            cache_file = self.cache[path]
-            del self.cache[path]
+        # Writes call this for every block, so skip the lock for uncached files;
+        # a copy reserved after this check stats the file after the write
+        if path not in self.entries and path not in self.pending:
+            return
             
-            # Remove from cache map
-            if cache_file in self.cache_map:
-                del self.cache_map[cache_file]
+        with self.lock:
+            # A copy in flight may already hold the old content
+            if path in self.pending:
+                self.stale.add(path)
+                
+            entry = self.entries.get(path)
+            if entry is None:
+                return
                 
-        # Remove from attrs if present
-        if path in self.attrs:
-            del self.attrs[path]
+            if self._unlink(path, entry):
+                logger.debug("Invalidated file in cache: %s", path)
     
     def get_attr(self, path):
         """Get attributes for a cached file."""
-        if path in self.attrs:
-            # Increment access frequency
-            self.frequency[path] = self.frequency.get(path, 0) + 1
-            return self.attrs[path]
-        return None
+        path = sys.intern(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.attrs is not None:
+                # Increment access frequency
+                self._increment_frequency(path, entry)
+                return entry.attrs
+            return None
     
     def clear(self):
         """Clear the entire cache."""
-        # Remove all cache files
-        for cache_path in self.cache.values():
-            if os.path.exists(cache_path):
-                try:
-                    os.remove(cache_path)
-                except Exception as e:
-                    logger.error(f"Error removing cache file {cache_path}: {e}")
-        
-        # Reset tracking dictionaries
-        self.frequency = {}
-        self.cache = {}
-        self.cache_map = {}
-        self.attrs = {}
-        self.total_size = 0
+        with self.lock:
+            # Close all descriptors before their files go away
+            for path, entry in self.entries.items():
+                self._close_fd(path, entry)
+                
+            # Remove the cache files in parallel so the unlink latencies overlap
+            cache_paths = [entry.cache_path for entry in self.entries.values()]
+            if cache_paths:
+                workers = min(_CLEAR_WORKERS, len(cache_paths))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(self._remove_cache_file, cache_paths))
+            
+            # Reset tracking dictionaries
+            self.entries = {}
+            self.open_entries = OrderedDict()
+            self.freq_buckets = {}
+            self.min_freq = 0
+            self.freq_heap = []
+            
+            # In-flight copies are abandoned and their reservations dropped
+            self.pending = {}
+            self.stale = set()
+            self.total_size = 0
         
-        logger.info("Cache cleared") 
\ No newline at end of file
+        logger.info("Cache cleared")
+    
+    def shutdown(self):
+        """Wait for background copies to finish and stop their workers."""
+        self.copy_executor.shutdown(wait=True)
\ No newline at end of file
@@ -2,12 +2,13 @@
 Google Drive integration for cloud synchronization.
 """
 import os
-import io
+import json
+import mmap
 import logging
 import hashlib
 import threading
-import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.oauth2.credentials import Credentials
@@ -19,6 +20,16 @@ from fuse_fs.database.db_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
+# Files smaller than this are hashed with a plain read instead of an mmap
+_HASH_MMAP_THRESHOLD = 64 * 1024
+
+# Maximum number of calls per Drive batch request; larger batches tend to fail
+_BATCH_SIZE = 25
+
+def _drive_escape(value):
+    """Escape a value for use inside a quoted string in a Drive query."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
 class GoogleDriveSync:
     """Google Drive synchronization for FUSE filesystem."""
     
@@ -29,18 +40,48 @@ class GoogleDriveSync:
         self.token_file = config.GOOGLE_TOKEN_FILE
         self.scopes = config.GOOGLE_API_SCOPES
         
+        # Storage path with a trailing separator, so full paths are a single concatenation
+        self.storage_prefix = os.path.join(self.storage_path, '')
+        
         # Initialize database connection
         self.db = DatabaseManager()
         
-        # Map of local path hashes to Google Drive file IDs
+        # Map of local file paths to Google Drive file IDs
         self.file_id_map = {}
         
+        # Trie of Google Drive folder IDs, one node per path component:
+        # {'id': folder_id, 'children': {name: node}}
+        self.dir_trie = {'id': 'root', 'children': {}}
+        
+        # Content hashes of local files (path -> (size, mtime_ns, hash)), so
+        # unchanged files aren't re-read and re-hashed on every sync
+        self.content_hashes = {}
+        
+        # Drive file IDs of content known to be on Drive (content hash -> ID),
+        # and the other way round, so an overwritten file's old hash is dropped
+        self.drive_ids_by_hash = {}
+        self.hashes_by_drive_id = {}
+        
         # For thread safety
         self.lock = threading.Lock()
         
+        # Ensures only one token refresh is in flight at a time
+        self.refresh_lock = threading.Lock()
+        
+        # Serializes folder creation so parallel uploads don't create duplicates
+        self.hierarchy_lock = threading.Lock()
+        
+        # The Drive client isn't thread-safe, so each thread gets its own service
+        self.local = threading.local()
+        self.credentials = None
+        
         # Initialize Google Drive service
         self.service = self._get_drive_service()
         
+        # Workers for uploading files in parallel
+        self.upload_pool = ThreadPoolExecutor(max_workers=config.MAX_CONCURRENT_UPLOADS)
+        self.upload_futures = {}
+        
         # Thread for background synchronization
         self.sync_thread = None
         self.stop_sync = threading.Event()
@@ -57,8 +98,10 @@ class GoogleDriveSync:
         # Check if token.json exists
         if os.path.exists(self.token_file):
             try:
+                with open(self.token_file, 'r') as token:
+                    info = json.load(token)
                 creds = Credentials.from_authorized_user_info(
-                    info=eval(open(self.token_file, 'r').read()),
+                    info=info,
                     scopes=self.scopes
                 )
             except Exception as e:
@@ -67,10 +110,7 @@ class GoogleDriveSync:
         # If credentials don't exist or are invalid, get new ones
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception as e:
-                    logger.error(f"Error refreshing credentials: {e}")
+                if not self._refresh_credentials(creds):
                     creds = None
             
             # If still no valid credentials, start OAuth flow
@@ -90,19 +130,53 @@ class GoogleDriveSync:
             # Save the credentials for the next run
             try:
                 with open(self.token_file, 'w') as token:
-                    token.write(str(creds.to_json()))
+                    token.write(creds.to_json())
             except Exception as e:
                 logger.error(f"Error saving credentials to token file: {e}")
         
         try:
             # Build the service
             service = build('drive', 'v3', credentials=creds)
+            self.credentials = creds
             logger.info("Successfully authenticated with Google Drive")
             return service
         except Exception as e:
             logger.error(f"Error building Drive service: {e}")
             return None
     
+    @property
+    def service(self):
+        """Google Drive service for the calling thread."""
+        # The threads' services share the credentials, and each client would
+        # otherwise refresh them itself, all at once; refresh them here, under
+        # the lock, before the client sees them expire
+        creds = self.credentials
+        if creds is not None and not creds.valid and creds.refresh_token:
+            self._refresh_credentials(creds)
+            
+        service = getattr(self.local, 'service', None)
+        if service is None and self.credentials is not None:
+            service = self.local.service = build('drive', 'v3', credentials=self.credentials)
+        return service
+    
+    @service.setter
+    def service(self, service):
+        self.local.service = service
+    
+    def _refresh_credentials(self, creds):
+        """Refresh expired credentials, coalescing concurrent refreshes."""
+        with self.refresh_lock:
+            # Another caller may have refreshed them while we waited
+            if creds.valid:
+                return True
+                
+            try:
+                creds.refresh(Request())
+                return True
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {e}")
+                return False
+    
     def _load_file_mapping(self):
         """Load existing file mapping from database."""
         with self.lock:
@@ -110,53 +184,120 @@ class GoogleDriveSync:
             files = self.db.get_files_with_drive_ids()
             
             for file in files:
-                file_hash = self._hash_path(file['path'])
-                self.file_id_map[file_hash] = file['google_drive_id']
-    
-    def _hash_path(self, path):
-        """Create a hash for the file path."""
-        return hashlib.sha256(path.encode()).hexdigest()
+                self.file_id_map[file['path']] = file['google_drive_id']
+                
+            # Rebuild the folder trie, parents before children, so resolving
+            # known folders needs no Drive queries after a restart
+            folders = sorted(self.db.get_drive_folders(), key=lambda row: row['path'].count('/'))
+            for row in folders:
+                *parents, name = row['path'].split('/')
+                node = self.dir_trie
+                for part in parents:
+                    node = node['children'].get(part)
+                    if node is None:
+                        break
+                else:
+                    node['children'][name] = {'id': row['drive_id'], 'children': {}}
+                    
+            # Hashes computed with another algorithm can't be reused
+            for row in self.db.get_content_hashes():
+                if row['algorithm'] == config.CONTENT_HASH_MODE:
+                    self.content_hashes[row['path']] = (row['size'], row['mtime_ns'], row['hash'])
+                    
+                    # A synced file's stored hash is the content its Drive copy has
+                    if row['google_drive_id'] and not row['needs_sync']:
+                        self.drive_ids_by_hash[row['hash']] = row['google_drive_id']
+                        self.hashes_by_drive_id[row['google_drive_id']] = row['hash']
     
     def _hash_file_content(self, file_path):
-        """Create a SHA-256 hash of file content for deduplication."""
+        """Create a hash of file content for deduplication."""
         if not os.path.exists(file_path):
             return None
             
         try:
-            sha256_hash = hashlib.sha256()
+            # BLAKE2b is considerably faster than SHA-256 in software; SHA-256
+            # stays available to match content hashes stored by older versions
+            if config.CONTENT_HASH_MODE == 'sha256':
+                content_hash = hashlib.sha256()
+            else:
+                content_hash = hashlib.blake2b(digest_size=32)
             
             with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
+                size = os.fstat(f.fileno()).st_size
+                
+                # Hash larger files as one mapped buffer so the digest runs in
+                # a single call instead of a Python loop over small blocks
+                if size < _HASH_MMAP_THRESHOLD:
+                    content_hash.update(f.read())
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content_hash.update(mm)
                     
-            return sha256_hash.hexdigest()
+            return content_hash.hexdigest()
         except Exception as e:
             logger.error(f"Error hashing file {file_path}: {e}")
             return None
     
+    def _get_content_hash(self, path, full_path):
+        """Get the content hash of a file, reusing it while the file is unchanged."""
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+            
+        cached = self.content_hashes.get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+            
+        # The cheaper modes stand in for the content with the file's identity
+        # and skip reading it; 'path' assumes files never change once synced
+        if config.CONTENT_HASH_MODE == 'path':
+            file_hash = hashlib.blake2b(path.encode(), digest_size=32).hexdigest()
+        elif config.CONTENT_HASH_MODE == 'mtime_size':
+            identity = f"{path}|{st.st_size}|{st.st_mtime_ns}"
+            file_hash = hashlib.blake2b(identity.encode(), digest_size=32).hexdigest()
+        else:
+            file_hash = self._hash_file_content(full_path)
+            
+        if file_hash:
+            self.content_hashes[path] = (st.st_size, st.st_mtime_ns, file_hash)
+            self.db.upsert_content_hash(path, st.st_size, st.st_mtime_ns,
+                                        config.CONTENT_HASH_MODE, file_hash)
+        return file_hash
+    
+    def _remember_drive_hash(self, file_hash, drive_id):
+        """Record that a Drive file holds the content with the given hash, and no other."""
+        with self.lock:
+            old_hash = self.hashes_by_drive_id.get(drive_id)
+            if old_hash is not None and old_hash != file_hash and self.drive_ids_by_hash.get(old_hash) == drive_id:
+                del self.drive_ids_by_hash[old_hash]
+            self.drive_ids_by_hash[file_hash] = drive_id
+            self.hashes_by_drive_id[drive_id] = file_hash
+    
     def _full_path(self, partial_path):
         """Helper to get the full path for a file in the storage directory."""
         if partial_path.startswith("/"):
             partial_path = partial_path[1:]
-        path = os.path.join(self.storage_path, partial_path)
-        return path
+        return self.storage_prefix + partial_path
     
     def _check_file_exists_by_hash(self, file_hash):
         """Check if file with the same content (hash) exists on Google Drive."""
+        # Content uploaded or seen before doesn't need a Drive query (a single
+        # get, as an overwrite can drop the hash from another thread)
+        drive_id = self.drive_ids_by_hash.get(file_hash)
+        if drive_id is not None:
+            return drive_id
+            
         if not self.service:
             return None
             
         try:
             # Search for file with the same hash property
-            query = f"appProperties has {{ key='content_hash' and value='{file_hash}' }}"
-            response = self.service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
+            response = self._hash_lookup_request(file_hash).execute()
             
             files = response.get('files', [])
             if files:
+                self._remember_drive_hash(file_hash, files[0]['id'])
                 return files[0]['id']
             
             return None
@@ -164,81 +305,123 @@ class GoogleDriveSync:
             logger.error(f"Error checking file exists by hash: {e}")
             return None
     
+    def _hash_lookup_request(self, file_hash):
+        """Build the Drive request that searches for a file by content hash."""
+        query = f"appProperties has {{ key='content_hash' and value='{_drive_escape(file_hash)}' }}"
+        return self.service.files().list(
+            q=query,
+            spaces='drive',
+            fields='files(id, name)'
+        )
+    
+    def _check_files_exist_by_hash(self, file_hashes):
+        """
+        Check several content hashes against Google Drive using batch requests.
+        
+        Returns:
+            Dictionary mapping each hash that could be looked up to the ID of a
+            matching Drive file, or None if there is no match
+        """
+        # Content uploaded or seen before doesn't need a Drive query
+        results = {}
+        unknown_hashes = []
+        for file_hash in file_hashes:
+            drive_id = self.drive_ids_by_hash.get(file_hash)
+            if drive_id is not None:
+                results[file_hash] = drive_id
+            else:
+                unknown_hashes.append(file_hash)
+                
+        if not self.service:
+            return results
+            
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Error checking file exists by hash: {exception}")
+                return
+            files = response.get('files', [])
+            results[request_id] = files[0]['id'] if files else None
+            if files:
+                self._remember_drive_hash(request_id, files[0]['id'])
+            
+        file_hashes = unknown_hashes
+        for start in range(0, len(file_hashes), _BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for file_hash in file_hashes[start:start + _BATCH_SIZE]:
+                batch.add(self._hash_lookup_request(file_hash), request_id=file_hash)
+                
+            try:
+                batch.execute()
+            except Exception as e:
+                logger.error(f"Error executing batch hash lookup: {e}")
+                
+        return results
+    
     def _create_file_hierarchy(self, path):
         """Create directory hierarchy on Google Drive to match the local path."""
         if not self.service:
             return None
             
         # Split path into components
-        path_parts = path.strip('/').split('/')
+        path_parts = [part for part in path.strip('/').split('/') if part]
         
         # If it's just a filename, no hierarchy needed
         if len(path_parts) <= 1:
             return 'root'
             
-        # Directory path (without the filename)
-        dir_path = '/'.join(path_parts[:-1])
-        
-        # Check if we already have this path mapped
-        dir_hash = self._hash_path(dir_path)
-        if dir_hash in self.file_id_map:
-            return self.file_id_map[dir_hash]
-        
-        # Start from root
-        parent_id = 'root'
-        current_path = ''
+        # Walk down the directory trie from root, one dict lookup per level
+        node = self.dir_trie
         
         # Create each directory in the path if needed
-        for i, part in enumerate(path_parts[:-1]):
-            if not part:
-                continue
-                
-            current_path = current_path + '/' + part if current_path else part
-            current_hash = self._hash_path(current_path)
-            
-            # Check if we already have this directory
-            if current_hash in self.file_id_map:
-                parent_id = self.file_id_map[current_hash]
-                continue
-            
-            # Search for the directory in the current parent
-            query = f"name='{part}' and mimeType='application/vnd.google-apps.folder' and '{parent_id}' in parents and trashed=false"
+        for depth, part in enumerate(path_parts[:-1], 1):
+            child = node['children'].get(part)
+            if child is None:
+                directory_id = self._find_or_create_folder(part, node['id'])
+                if directory_id is None:
+                    return node['id']
+                child = node['children'][part] = {'id': directory_id, 'children': {}}
+                self.db.upsert_drive_folder('/'.join(path_parts[:depth]), directory_id)
+            node = child
+        
+        return node['id']
+    
+    def _find_or_create_folder(self, name, parent_id):
+        """Get the ID of a folder on Google Drive, creating it if it doesn't exist."""
+        # Search for the directory in the current parent
+        query = (f"name='{_drive_escape(name)}' and mimeType='application/vnd.google-apps.folder' "
+                 f"and '{_drive_escape(parent_id)}' in parents and trashed=false")
+        try:
             response = self.service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)'
             ).execute()
+        except Exception as e:
+            logger.error(f"Error looking up directory {name}: {e}")
+            return None
             
-            items = response.get('files', [])
-            
-            if items:
-                # Directory exists
-                directory_id = items[0]['id']
-            else:
-                # Create directory
-                file_metadata = {
-                    'name': part,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [parent_id]
-                }
-                
-                try:
-                    directory = self.service.files().create(
-                        body=file_metadata,
-                        fields='id'
-                    ).execute()
-                    directory_id = directory.get('id')
-                except Exception as e:
-                    logger.error(f"Error creating directory {part}: {e}")
-                    return parent_id
-            
-            # Update parent for next iteration
-            parent_id = directory_id
+        items = response.get('files', [])
+        
+        if items:
+            # Directory exists
+            return items[0]['id']
             
-            # Update mapping
-            self.file_id_map[current_hash] = parent_id
+        # Create directory
+        file_metadata = {
+            'name': name,
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [parent_id]
+        }
         
-        return parent_id
+        try:
+            directory = self.service.files().create(
+                body=file_metadata,
+                fields='id'
+            ).execute()
+            return directory.get('id')
+        except Exception as e:
+            logger.error(f"Error creating directory {name}: {e}")
+            return None
     
     def start_background_sync(self):
         """Start background synchronization thread."""
@@ -246,6 +429,9 @@ class GoogleDriveSync:
             logger.warning("Background sync is already running")
             return
             
+        # A stopped sync has shut its upload pool down, so start on a fresh one
+        self.upload_pool.shutdown(wait=False)
+        self.upload_pool = ThreadPoolExecutor(max_workers=config.MAX_CONCURRENT_UPLOADS)
         self.stop_sync.clear()
         self.sync_thread = threading.Thread(
             target=self._background_sync_task,
@@ -256,10 +442,16 @@ class GoogleDriveSync:
     
     def stop_background_sync(self):
         """Stop background synchronization thread."""
+        self.stop_sync.set()
+        
+        # Cancel uploads that haven't started and let the ones in flight
+        # finish, so the sync thread can record them before the database goes away
+        for future in list(self.upload_futures):
+            future.cancel()
+        self.upload_pool.shutdown(wait=True)
         if not self.sync_thread:
             return
             
-        self.stop_sync.set()
         self.sync_thread.join(timeout=5)
         logger.info("Stopped background synchronization thread")
     
@@ -273,31 +465,61 @@ class GoogleDriveSync:
                 if files_to_sync:
                     logger.info(f"Found {len(files_to_sync)} files to sync")
                     
+                    # Look up all content hashes on Drive in one round-trip
+                    # instead of one request per file
+                    file_hashes = set()
                     for file_info in files_to_sync:
+                        full_path = self._full_path(file_info['path'])
+                        if os.path.isfile(full_path):
+                            file_hash = self._get_content_hash(file_info['path'], full_path)
+                            if file_hash:
+                                file_hashes.add(file_hash)
+                    remote_hashes = self._check_files_exist_by_hash(file_hashes)
+                    
+                    # Uploads are independent, so overlap their network waits
+                    futures = self.upload_futures = {
+                        self.upload_pool.submit(self.sync_file, file_info['path'], remote_hashes): file_info['id']
+                        for file_info in files_to_sync
+                    }
+                    
+                    results = []
+                    for future in as_completed(futures):
                         if self.stop_sync.is_set():
-                            break
+                            # Drop uploads that haven't started yet, but still
+                            # record the ones that ran
+                            for pending in futures:
+                                pending.cancel()
+                        if future.cancelled():
+                            continue
                             
-                        file_id = file_info['id']
-                        file_path = file_info['path']
-                        
-                        # Sync file
-                        success, drive_id, error = self.sync_file(file_path)
+                        try:
+                            success, drive_id, error = future.result()
+                        except Exception as e:
+                            # Record the failure without losing the rest of the round
+                            logger.error(f"Error syncing file ID {futures[future]}: {e}")
+                            success, drive_id, error = False, None, str(e)
+                        results.append((futures[future], success, drive_id, error))
                         
-                        # Update database with sync status
-                        self.db.update_sync_status(file_id, success, drive_id, error)
+                    # Update database with the sync status of the whole round at once
+                    self.db.update_sync_status_bulk(results)
                 
-                # Sleep before checking again
-                for _ in range(config.SYNC_INTERVAL):
-                    if self.stop_sync.is_set():
-                        break
-                    time.sleep(1)
+                # Sleep before checking again, waking up early on stop
+                if self.stop_sync.wait(timeout=config.SYNC_INTERVAL):
+                    break
                     
             except Exception as e:
                 logger.error(f"Error in background sync task: {e}")
-                time.sleep(60)  # Sleep for a minute if there's an error
+                self.stop_sync.wait(60)  # Sleep for a minute if there's an error
     
-    def sync_file(self, path):
-        """Synchronize a file to Google Drive."""
+    def sync_file(self, path, remote_hashes=None):
+        """
+        Synchronize a file to Google Drive.
+        
+        Args:
+            path: Path of the file within the filesystem
+            remote_hashes: Optional results of _check_files_exist_by_hash; it is
+                updated with the IDs of files uploaded here
+        """
         if not self.service:
             return False, None, "Google Drive service not initialized"
             
@@ -309,28 +531,38 @@ class GoogleDriveSync:
             
         if os.path.isdir(full_path):
             # For directories, just create the folder structure
-            parent_id = self._create_file_hierarchy(path)
+            try:
+                with self.hierarchy_lock:
+                    parent_id = self._create_file_hierarchy(path)
+            except Exception as e:
+                error_msg = f"Error syncing directory {path}: {str(e)}"
+                logger.error(error_msg)
+                return False, None, error_msg
             return True, parent_id, None
         
         try:
             # Compute file hash for deduplication
-            file_hash = self._hash_file_content(full_path)
+            file_hash = self._get_content_hash(path, full_path)
             
             if not file_hash:
                 return False, None, f"Unable to compute hash for {full_path}"
                 
             # Check if file with same content already exists on Drive
-            existing_file_id = self._check_file_exists_by_hash(file_hash)
+            if remote_hashes is not None and file_hash in remote_hashes:
+                existing_file_id = remote_hashes[file_hash]
+            else:
+                existing_file_id = self._check_file_exists_by_hash(file_hash)
             
             if existing_file_id:
                 # File already exists, update our mapping
-                path_hash = self._hash_path(path)
-                self.file_id_map[path_hash] = existing_file_id
+                with self.lock:
+                    self.file_id_map[path] = existing_file_id
                 logger.info(f"File already exists on Drive (deduplication): {path}")
                 return True, existing_file_id, None
             
             # Get or create parent folder
-            parent_id = self._create_file_hierarchy(path)
+            with self.hierarchy_lock:
+                parent_id = self._create_file_hierarchy(path)
             
             # File metadata
             filename = os.path.basename(path)
@@ -344,17 +576,25 @@ class GoogleDriveSync:
             }
             
             # Check if file already exists (by path)
-            path_hash = self._hash_path(path)
-            update = path_hash in self.file_id_map
+            update = path in self.file_id_map
             
             if update:
                 # Update existing file
-                file_id = self.file_id_map[path_hash]
+                file_id = self.file_id_map[path]
                 
+                # Files deduplicated onto it lose their copy, so they upload their own
+                old_hash = self.hashes_by_drive_id.get(file_id)
+                if old_hash != file_hash:
+                    with self.lock:
+                        for other_path, other_id in list(self.file_id_map.items()):
+                            if other_id == file_id and other_path != path:
+                                del self.file_id_map[other_path]
+                    self.db.release_drive_copies(file_id, path)
+                    
                 # Remove parents field for update
                 del file_metadata['parents']
                 
-                media = MediaFileUpload(full_path, resumable=True)
+                media = self._media_upload(full_path)
                 file = self.service.files().update(
                     fileId=file_id,
                     body=file_metadata,
@@ -362,11 +602,17 @@ class GoogleDriveSync:
                     fields='id'
                 ).execute()
                 
+                self._remember_drive_hash(file_hash, file_id)
+                if remote_hashes is not None:
+                    remote_hashes[file_hash] = file_id
+                    if old_hash is not None and remote_hashes.get(old_hash) == file_id:
+                        del remote_hashes[old_hash]
+                    
                 logger.info(f"Updated file on Drive: {path}")
                 return True, file_id, None
             else:
                 # Create new file
-                media = MediaFileUpload(full_path, resumable=True)
+                media = self._media_upload(full_path)
                 file = self.service.files().create(
                     body=file_metadata,
                     media_body=media,
@@ -374,7 +620,11 @@ class GoogleDriveSync:
                 ).execute()
                 
                 file_id = file.get('id')
-                self.file_id_map[path_hash] = file_id
+                with self.lock:
+                    self.file_id_map[path] = file_id
+                self._remember_drive_hash(file_hash, file_id)
+                if remote_hashes is not None:
+                    remote_hashes[file_hash] = file_id
                 
                 logger.info(f"Created file on Drive: {path}")
                 return True, file_id, None
@@ -384,6 +634,13 @@ class GoogleDriveSync:
             logger.error(error_msg)
             return False, None, error_msg
     
+    def _media_upload(self, full_path):
+        """Build the media body for uploading a local file."""
+        # Small files go up in a single multipart request; larger ones use
+        # resumable uploads with big chunks to keep the request count down
+        resumable = os.path.getsize(full_path) >= config.SMALL_FILE_THRESHOLD
+        return MediaFileUpload(full_path, chunksize=config.UPLOAD_CHUNK_SIZE, resumable=resumable)
+    
     def download_file(self, path, drive_id=None):
         """Download a file from Google Drive."""
         if not self.service:
@@ -393,8 +650,7 @@ class GoogleDriveSync:
             # Get file ID
             file_id = drive_id
             if not file_id:
-                path_hash = self._hash_path(path)
-                file_id = self.file_id_map.get(path_hash)
+                file_id = self.file_id_map.get(path)
                 
             if not file_id:
                 return False, f"File not found on Drive: {path}"
@@ -405,18 +661,30 @@ class GoogleDriveSync:
             # Ensure directory exists
             os.makedirs(os.path.dirname(full_path), exist_ok=True)
             
-            # Download file
+            # Download file, streaming each chunk straight to disk. It goes to a
+            # temporary name first so a failed download never replaces the file
             request = self.service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                
-            # Save to file
-            with open(full_path, 'wb') as f:
-                f.write(fh.getvalue())
+            part_path = full_path + '.part'
+            try:
+                with open(part_path, 'wb') as f:
+                    downloader = MediaIoBaseDownload(f, request, chunksize=config.DOWNLOAD_CHUNK_SIZE)
+                    
+                    done = False
+                    while not done:
+                        status, done = downloader.next_chunk()
+                        
+                    # The downloaded data isn't likely to be read again soon
+                    if hasattr(os, 'posix_fadvise'):
+                        f.flush()
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                        
+                os.replace(part_path, full_path)
+            except Exception:
+                try:
+                    os.remove(part_path)
+                except FileNotFoundError:
+                    pass
+                raise
                 
             logger.info(f"Downloaded file from Drive: {path}")
             return True, None
@@ -21,6 +21,10 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'fuse_fs'),
     'port': int(os.getenv('DB_PORT', '3306')),
 }
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))  # Connections in the pool shared by all DatabaseManagers in the process
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '2000'))  # Queued new files per multi-row INSERT
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '1.0'))  # Seconds queued new files may wait
+ACCESS_HISTORY_DAYS = int(os.getenv('ACCESS_HISTORY_DAYS', '7'))  # Days of access history kept (0 keeps all)
 
 # Google Drive API settings
 GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
@@ -30,10 +34,19 @@ GOOGLE_API_SCOPES = ['https://www.googleapis.com/auth/drive']
 # LFU Cache settings
 CACHE_SIZE = int(os.getenv('CACHE_SIZE', '100'))  # Number of files to cache
 CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(DEFAULT_STORAGE_PATH, 'cache'))
+CACHE_COPY_WORKERS = int(os.getenv('CACHE_COPY_WORKERS', '8'))  # Parallel copies in add_many
+CACHE_BACKGROUND_WORKERS = int(os.getenv('CACHE_BACKGROUND_WORKERS', '2'))  # Background copies started on open
+CACHE_MMAP_THRESHOLD = int(os.getenv('CACHE_MMAP_THRESHOLD', str(1024 * 1024)))  # Bytes; larger files are mmapped
+CACHE_MAX_OPEN_FILES = int(os.getenv('CACHE_MAX_OPEN_FILES', '256'))  # Cached files kept open for reads at once
 
 # Sync settings
 SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL', '300'))  # In seconds (default: 5 minutes)
 MAX_SYNC_RETRIES = int(os.getenv('MAX_SYNC_RETRIES', '3'))
+MAX_CONCURRENT_UPLOADS = int(os.getenv('MAX_CONCURRENT_UPLOADS', '4'))
+CONTENT_HASH_MODE = os.getenv('CONTENT_HASH_MODE', 'blake2b').lower()  # blake2b, sha256 (older versions), mtime_size or path
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(32 * 1024 * 1024)))  # Bytes; must be a multiple of 256 KiB
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(32 * 1024 * 1024)))  # Bytes
+SMALL_FILE_THRESHOLD = int(os.getenv('SMALL_FILE_THRESHOLD', str(5 * 1024 * 1024)))  # Bytes; smaller files upload in one request
 
 # Security settings
 ENCRYPTION_ENABLED = os.getenv('ENCRYPTION_ENABLED', 'False').lower() == 'true'
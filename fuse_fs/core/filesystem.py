@@ -2,17 +2,33 @@
 Core FUSE filesystem implementation.
 """
 import os
+import time
 import errno
 import logging
+import itertools
+import threading
+import collections
 from datetime import datetime
 from fuse import FUSE, FuseOSError, Operations
 
 from fuse_fs import config
 from fuse_fs.database.db_manager import DatabaseManager
 from fuse_fs.cache.lfu_cache import LFUCache
+from fuse_fs.utils.logger import start_listener
 
 logger = logging.getLogger(__name__)
 
+# Seconds a directory's file names from the database are reused by readdir
+_DB_LISTING_TTL = 1.0
+
+# Attributes reported by getattr
+_ATTR_KEYS = ('st_atime', 'st_ctime', 'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid')
+
+# Attributes gathered by readdir are kept this long for the getattr calls
+# that follow a listing, and the table is dropped once it grows past the limit
+_LISTED_ATTRS_TTL = 1.0
+_LISTED_ATTRS_MAX = 10000
+
 class FuseFS(Operations):
     """FUSE Virtual File System implementation with metadata storage and LFU caching."""
     
@@ -24,15 +40,40 @@ class FuseFS(Operations):
         # Create storage directory if it doesn't exist
         os.makedirs(self.storage_path, exist_ok=True)
         
+        # Storage path with a trailing separator, so full paths are a single concatenation
+        self.storage_prefix = os.path.join(self.storage_path, '')
+        
         # Initialize database connection
         self.db = DatabaseManager()
         
         # Initialize LFU cache
         self.cache = LFUCache(max_size=config.CACHE_SIZE, cache_dir=config.CACHE_DIR)
         
-        # For keeping file handles
+        # For keeping file handles; next() on a count is atomic, so handles
+        # can be allocated from concurrent FUSE threads without a lock
         self.open_files = {}
-        self.fd = 0
+        self.handles = itertools.count(1)
+        
+        # Paths written since their metadata was last stored in the database
+        self.dirty_paths = set()
+        
+        # Flushed paths waiting for the metadata writer thread to store them
+        self.written_queue = collections.deque()
+        self.written_ready = threading.Event()
+        self.stop_writer = threading.Event()
+        self.writer_thread = None
+        
+        # Database updates FUSE calls don't wait for, run in order by the writer thread
+        self.db_tasks = collections.deque()
+        
+        # Stat key last stored by getattr for each path, to skip unchanged writes
+        self.stored_attrs = {}
+        
+        # Recent database listings for readdir (path -> (time, file names))
+        self.db_listings = {}
+        
+        # Attributes of entries from the last listings (path -> (time, attr))
+        self.listed_attrs = {}
         
         logger.info(f"Initialized FUSE filesystem with storage at {self.storage_path}")
 
@@ -40,11 +81,83 @@ class FuseFS(Operations):
         """Helper to get the full path for a file in the storage directory."""
         if partial_path.startswith("/"):
             partial_path = partial_path[1:]
-        path = os.path.join(self.storage_path, partial_path)
-        return path
+        return self.storage_prefix + partial_path
+    
+    def _store_written(self, path):
+        """Store size, mtime and sync state for a file written since the last call."""
+        # Removing is atomic, so concurrent flushes store the path only once
+        try:
+            self.dirty_paths.remove(path)
+        except KeyError:
+            return
+            
+        # The database update is left to the writer thread, off the FUSE thread
+        self.written_queue.append(path)
+        self.written_ready.set()
+    
+    def _run_in_background(self, func, *args):
+        """Hand a database update to the writer thread instead of waiting on it."""
+        self.db_tasks.append((func, args))
+        self.written_ready.set()
+    
+    def _metadata_writer(self):
+        """Run queued database updates and store written-file metadata until unmount."""
+        while not self.stop_writer.is_set():
+            self.written_ready.wait(timeout=config.DB_FLUSH_INTERVAL)
+            self.written_ready.clear()
+            try:
+                self._run_db_tasks()
+                self._drain_written()
+                
+                # New files queued by create/mkdir and file accesses go in even
+                # when nothing was written
+                self.db.flush_files()
+                self.db.flush_access_times()
+            except Exception as e:
+                # Keep the writer alive; whatever is still queued goes in next round
+                logger.error(f"Error in metadata writer: {e}")
+    
+    def _run_db_tasks(self):
+        """Run every queued database update."""
+        while True:
+            try:
+                func, args = self.db_tasks.popleft()
+            except IndexError:
+                break
+                
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Background database update failed: {e}")
+    
+    def _drain_written(self):
+        """Store the metadata of every queued written file in one batch."""
+        paths = set()
+        while True:
+            try:
+                paths.add(self.written_queue.popleft())
+            except IndexError:
+                break
+                
+        files = []
+        for path in paths:
+            try:
+                files.append((path, os.path.getsize(self._full_path(path))))
+            except OSError:
+                pass
+                
+        if files:
+            self.db.mark_files_written(files)
 
     # Filesystem methods
     # ==================
+    
+    def init(self, path):
+        """Start the metadata writer and log listener once the filesystem is mounted."""
+        # Started here rather than in __init__ so the threads survive daemonizing
+        start_listener()
+        self.writer_thread = threading.Thread(target=self._metadata_writer, daemon=True)
+        self.writer_thread.start()
 
     def access(self, path, mode):
         """Check if the file exists and has the requested permissions."""
@@ -55,11 +168,13 @@ class FuseFS(Operations):
     def chmod(self, path, mode):
         """Change the mode (permissions) of a file."""
         full_path = self._full_path(path)
+        self.listed_attrs.pop(path, None)
         return os.chmod(full_path, mode)
 
     def chown(self, path, uid, gid):
         """Change the owner of a file."""
         full_path = self._full_path(path)
+        self.listed_attrs.pop(path, None)
         return os.chown(full_path, uid, gid)
 
     def getattr(self, path, fh=None):
@@ -71,15 +186,25 @@ class FuseFS(Operations):
         if cached_attr:
             return cached_attr
             
-        if not os.path.exists(full_path):
+        # Entries of a directory that was just listed were stat'ed and stored by readdir
+        listed = self.listed_attrs.pop(path, None)
+        if listed is not None and time.monotonic() - listed[0] < _LISTED_ATTRS_TTL:
+            return listed[1]
+            
+        try:
+            st = os.lstat(full_path)
+        except FileNotFoundError:
             raise FuseOSError(errno.ENOENT)
             
-        st = os.lstat(full_path)
-        attr = {key: getattr(st, key) for key in ('st_atime', 'st_ctime',
-                 'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid')}
+        attr = {key: getattr(st, key) for key in _ATTR_KEYS}
                  
-        # Store in database for extended metadata tracking
-        self.db.update_file_metadata(path, attr)
+        # Store in database for extended metadata tracking, but only when
+        # something besides the access time changed since the last store
+        # (ownership and mode changes update ctime)
+        stat_key = (st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+        if self.stored_attrs.get(path) != stat_key:
+            if self.db.update_file_metadata(path, attr):
+                self.stored_attrs[path] = stat_key
                  
         return attr
 
@@ -87,26 +212,70 @@ class FuseFS(Operations):
         """Read directory and yield entries."""
         full_path = self._full_path(path)
         
-        dirents = ['.', '..']
-        if os.path.isdir(full_path):
-            dirents.extend(os.listdir(full_path))
+        seen = {'.', '..'}
+        yield '.'
+        yield '..'
+        
+        prefix = path.rstrip('/') + '/'
+        listed = []
+        try:
+            with os.scandir(full_path) as it:
+                for entry in it:
+                    seen.add(entry.name)
+                    try:
+                        listed.append((prefix + entry.name, entry.stat(follow_symlinks=False)))
+                    except OSError:
+                        pass
+                    yield entry.name
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+            
+        # The kernel follows a listing with a getattr for every entry, so
+        # answer those from here and store the whole directory in one go
+        if listed:
+            self._store_listed(listed)
             
         # Check for any files that might be in the database but not in the filesystem
-        db_files = self.db.get_directory_files(path)
-        for file_name in db_files:
-            if file_name not in dirents:
-                dirents.append(file_name)
+        for file_name in self._get_db_listing(path):
+            if file_name not in seen:
+                yield file_name
+    
+    def _store_listed(self, listed):
+        """Keep the attributes of listed entries and store the changed ones in the database."""
+        if len(self.listed_attrs) > _LISTED_ATTRS_MAX:
+            self.listed_attrs.clear()
+            
+        now = time.monotonic()
+        changed = []
+        for path, st in listed:
+            attr = {key: getattr(st, key) for key in _ATTR_KEYS}
+            self.listed_attrs[path] = (now, attr)
+            stat_key = (st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+            if self.stored_attrs.get(path) != stat_key:
+                changed.append((path, attr, stat_key))
                 
-        for entry in dirents:
-            yield entry
+        if changed and self.db.update_files_metadata([(path, attr) for path, attr, _ in changed]):
+            for path, _, stat_key in changed:
+                self.stored_attrs[path] = stat_key
+    
+    def _get_db_listing(self, path):
+        """Get the file names the database has for a directory, briefly cached."""
+        now = time.monotonic()
+        cached = self.db_listings.get(path)
+        if cached is not None and now - cached[0] < _DB_LISTING_TTL:
+            return cached[1]
+            
+        db_files = self.db.get_directory_files(path)
+        self.db_listings[path] = (now, db_files)
+        return db_files
 
     def mkdir(self, path, mode):
         """Create a directory."""
         full_path = self._full_path(path)
         os.makedirs(full_path, mode)
         
-        # Store directory metadata in database
-        self.db.add_directory(path, mode)
+        # Queue directory metadata for the next batch insert
+        self.db.queue_file(path, mode, is_directory=True)
         
         return 0
 
@@ -114,6 +283,8 @@ class FuseFS(Operations):
         """Remove a directory."""
         full_path = self._full_path(path)
         os.rmdir(full_path)
+        self.stored_attrs.pop(path, None)
+        self.listed_attrs.pop(path, None)
         
         # Remove directory metadata from database
         self.db.remove_directory(path)
@@ -131,15 +302,20 @@ class FuseFS(Operations):
             
             # Set the proper permissions
             os.chmod(full_path, mode)
+            self.listed_attrs.pop(path, None)
             
             # Create a file descriptor
-            self.fd += 1
-            self.open_files[self.fd] = os.open(full_path, os.O_RDWR)
+            fh = next(self.handles)
+            fd = os.open(full_path, os.O_RDWR)
+            self.open_files[fh] = fd
             
-            # Add file metadata to database
-            self.db.add_file(path, mode)
+            # Queue file metadata for the next batch insert, and count it as
+            # stored so the getattr that follows a create doesn't force a flush
+            self.db.queue_file(path, mode)
+            st = os.fstat(fd)
+            self.stored_attrs[path] = (st.st_mtime_ns, st.st_ctime_ns, st.st_size)
             
-            return self.fd
+            return fh
         except Exception as e:
             logger.error(f"Create error for {path}: {e}")
             raise FuseOSError(errno.EIO)
@@ -150,31 +326,37 @@ class FuseFS(Operations):
         
         # Check if file is in cache
         if self.cache.has(path):
-            logger.debug(f"Cache hit for {path}")
+            logger.debug("Cache hit for %s", path)
         else:
-            logger.debug(f"Cache miss for {path}")
-            # Add to cache if it's a read operation
-            if flags & os.O_RDONLY:
-                self.cache.add(path, full_path)
+            logger.debug("Cache miss for %s", path)
+            # Add to cache if it's opened read-only (O_RDONLY is 0, so compare
+            # the access mode); the copy runs in the background and reads are
+            # served from storage until it's done
+            if (flags & os.O_ACCMODE) == os.O_RDONLY:
+                self.cache.add_async(path, full_path)
         
-        self.fd += 1
-        self.open_files[self.fd] = os.open(full_path, flags)
+        fh = next(self.handles)
+        self.open_files[fh] = os.open(full_path, flags)
         
-        # Update access timestamp in database
+        # Queue the access for the next access history batch
         self.db.update_access_time(path)
         
-        return self.fd
+        return fh
 
     def read(self, path, length, offset, fh):
         """Read data from a file."""
-        # Try to read from cache first
-        if self.cache.has(path):
-            data = self.cache.read(path, length, offset)
-            if data is not None:
-                return data
+        # Try to read from cache first; a miss returns None without a stat
+        data = self.cache.read(path, length, offset)
+        if data is not None:
+            return data
         
-        # If not in cache or cache read failed, read from disk
+        # If not in cache or cache read failed, read from disk through the
+        # descriptor opened for this handle rather than reopening the file
         try:
+            fd = self.open_files.get(fh)
+            if fd is not None:
+                return os.pread(fd, length, offset)
+                
             with open(self._full_path(path), 'rb') as f:
                 f.seek(offset)
                 return f.read(length)
@@ -185,45 +367,47 @@ class FuseFS(Operations):
     def write(self, path, buf, offset, fh):
         """Write data to a file."""
         try:
-            with open(self._full_path(path), 'r+b') as f:
-                f.seek(offset)
-                bytes_written = f.write(buf)
+            fd = self.open_files.get(fh)
+            if fd is not None:
+                bytes_written = os.pwrite(fd, buf, offset)
+            else:
+                with open(self._full_path(path), 'r+b') as f:
+                    f.seek(offset)
+                    bytes_written = f.write(buf)
                 
-                # Update file in cache if it's there
-                if self.cache.has(path):
-                    self.cache.invalidate(path)
-                    
-                # Update file size and modification time in database
-                self.db.update_file_size(path, offset + bytes_written)
-                self.db.update_modification_time(path)
-                
-                # Mark file for synchronization
-                self.db.mark_for_sync(path)
+            # Drop the cached copy, including one still being copied in
+            self.cache.invalidate(path)
                 
-                return bytes_written
+            # The database is updated once on flush/release instead of three
+            # statements for every block written
+            self.dirty_paths.add(path)
+            self.listed_attrs.pop(path, None)
+            
+            return bytes_written
         except Exception as e:
             logger.error(f"Write error for {path}: {e}")
             raise FuseOSError(errno.EIO)
 
     def truncate(self, path, length, fh=None):
         """Truncate a file to the specified length."""
-        full_path = self._full_path(path)
-        
-        with open(full_path, 'r+') as f:
-            f.truncate(length)
+        if fh in self.open_files:
+            os.ftruncate(self.open_files[fh], length)
+        else:
+            os.truncate(self._full_path(path), length)
+        self.listed_attrs.pop(path, None)
             
         # Invalidate cache
-        if self.cache.has(path):
-            self.cache.invalidate(path)
+        self.cache.invalidate(path)
             
-        # Update file size in database
-        self.db.update_file_size(path, length)
+        # Update file size in database, without holding up the truncate
+        self._run_in_background(self.db.update_file_size, path, length)
         
         return 0
 
     def flush(self, path, fh):
         """Flush cached data to disk."""
         try:
+            self._store_written(path)
             if fh in self.open_files:
                 return os.fsync(self.open_files[fh])
             return 0
@@ -233,14 +417,16 @@ class FuseFS(Operations):
 
     def release(self, path, fh):
         """Release an open file."""
-        if fh in self.open_files:
-            os.close(self.open_files[fh])
-            del self.open_files[fh]
+        self._store_written(path)
+        fd = self.open_files.pop(fh, None)
+        if fd is not None:
+            os.close(fd)
         return 0
 
     def fsync(self, path, fdatasync, fh):
         """Sync file contents to disk."""
         try:
+            self._store_written(path)
             full_path = self._full_path(path)
             if os.path.exists(full_path):
                 with open(full_path, 'rb') as f:
@@ -254,13 +440,16 @@ class FuseFS(Operations):
         """Delete a file."""
         full_path = self._full_path(path)
         os.unlink(full_path)
+        self.dirty_paths.discard(path)
+        self.stored_attrs.pop(path, None)
+        self.listed_attrs.pop(path, None)
         
-        # Remove from cache if present
-        if self.cache.has(path):
-            self.cache.invalidate(path)
+        # Remove from cache, including a copy still in flight
+        self.cache.invalidate(path)
             
         # Remove file metadata from database
         self.db.remove_file(path)
+        self.db_listings.pop(os.path.dirname(path), None)
         
         return 0
 
@@ -270,15 +459,45 @@ class FuseFS(Operations):
         new_full_path = self._full_path(new)
         
         os.rename(old_full_path, new_full_path)
+        self.stored_attrs.pop(old, None)
+        self.stored_attrs.pop(new, None)
+        self.listed_attrs.pop(old, None)
+        self.listed_attrs.pop(new, None)
+        
+        # Pending writes follow the file to its new path
+        if old in self.dirty_paths:
+            self.dirty_paths.discard(old)
+            self.dirty_paths.add(new)
         
-        # Update cache and database
-        if self.cache.has(old):
-            self.cache.invalidate(old)
+        # Update cache and database; a file renamed over is replaced too
+        self.cache.invalidate(old)
+        self.cache.invalidate(new)
             
         self.db.rename_file(old, new)
+        self.db_listings.pop(os.path.dirname(old), None)
+        self._store_written(new)
         
         return 0
 
+    def destroy(self, path):
+        """Persist the cache index when the filesystem is unmounted."""
+        for path in list(self.dirty_paths):
+            self._store_written(path)
+            
+        # Stop the metadata writer and store whatever it hasn't got to
+        self.stop_writer.set()
+        self.written_ready.set()
+        if self.writer_thread:
+            self.writer_thread.join()
+        self._run_db_tasks()
+        self._drain_written()
+        self.db.flush_files()
+        self.db.flush_access_times()
+            
+        # Let in-flight background copies land so they make it into the index
+        self.cache.shutdown()
+        self.cache.save_index()
+
 def mount_filesystem(storage_path=None, mount_point=None, foreground=True):
     """Mount the FUSE filesystem."""
     storage = storage_path or config.DEFAULT_STORAGE_PATH
@@ -290,11 +509,16 @@ def mount_filesystem(storage_path=None, mount_point=None, foreground=True):
     logger.info(f"Mounting filesystem at {mount} with storage at {storage}")
     
     # Start the FUSE filesystem
+    # Requests are served from several threads. This relies on every operation
+    # that changes a file's content (write, truncate, unlink, rename) calling
+    # cache.invalidate() unconditionally, which also drops a copy of the file
+    # still being made in the background by open(); the cache's lock alone
+    # doesn't keep a concurrent copy from going stale
     FUSE(
         FuseFS(storage, mount),
         mount,
         foreground=foreground,
-        nothreads=True,
+        nothreads=False,
         allow_other=True,
     )
     
@@ -2,40 +2,150 @@
 Database manager for FUSE filesystem metadata storage.
 """
 import os
+import stat
+import time
 import logging
 import datetime
-import mysql.connector
-from mysql.connector import Error
+import threading
+import collections
+from mysql.connector import pooling, Error
 
 from fuse_fs import config
 
 logger = logging.getLogger(__name__)
 
+# Cached path to id lookups are dropped once there are more than this many
+_FILE_ID_CACHE_MAX = 100000
+
+# Paths looked up per SELECT ... IN query
+_LOOKUP_BATCH_SIZE = 1000
+
+# Seconds between prunes of old access history, and rows deleted per statement
+_PRUNE_INTERVAL = 3600.0
+_PRUNE_BATCH_SIZE = 10000
+
+# Seconds an access ranking from get_most_accessed_files is reused, as
+# other managers (the sync process) write to the tables as well
+_RANKING_CACHE_TTL = 30.0
+
 class DatabaseManager:
     """Manages database operations for the FUSE filesystem."""
     
+    # One connection pool per process, shared by every manager (the filesystem
+    # and the sync each make one) and closed when the last of them closes
+    _shared_pool = None
+    _shared_users = 0
+    _shared_lock = threading.Lock()
+    
+    # Bounds concurrent borrowers of the shared pool, as it raises instead of waiting
+    _shared_slots = threading.BoundedSemaphore(config.DB_POOL_SIZE)
+    
     def __init__(self):
-        """Initialize the database connection and create tables if needed."""
-        self.connection = None
+        """Initialize the database connection pool and create tables if needed."""
+        self.pool = None
+        self.slots = DatabaseManager._shared_slots
+        
+        # Rows queued by queue_file, inserted together by flush_files. The lock
+        # is held through the insert, so nothing runs ahead of queued rows
+        self.pending_files = []
+        self.pending_lock = threading.Lock()
+        
+        # File accesses waiting for flush_access_times, as (path, time)
+        self.pending_accesses = []
+        self.access_lock = threading.Lock()
+        
+        # When access history was last pruned (None until the first flush)
+        self.last_prune = None
+        
+        # File ids by path, for writing access history rows and metadata
+        # updates without looking the path up first
+        self.file_ids = {}
+        
+        # Access rankings by limit (limit -> (version, time, rows)), reused
+        # until a write from this manager bumps the version or they expire
+        self.rankings = {}
+        self.version = 0
+        
         self._connect()
         self._create_tables()
     
     def _connect(self):
-        """Connect to the MySQL database."""
+        """Join the pool of connections to the MySQL database, creating it if needed."""
+        with DatabaseManager._shared_lock:
+            try:
+                if DatabaseManager._shared_pool is None:
+                    DatabaseManager._shared_pool = pooling.MySQLConnectionPool(
+                        pool_name="fuse_fs",
+                        pool_size=config.DB_POOL_SIZE,
+                        # Nothing here relies on session state, so skip the reset round
+                        # trip each borrowed connection would make after committing
+                        pool_reset_session=False,
+                        **config.DB_CONFIG
+                    )
+                    logger.info("Connected to MySQL database")
+                DatabaseManager._shared_users += 1
+                self.pool = DatabaseManager._shared_pool
+            except Error as e:
+                logger.error(f"Error connecting to MySQL database: {e}")
+    
+    def _get_connection(self):
+        """Borrow a connection for a statement, after writing out queued rows it may depend on."""
+        if self.pending_files:
+            self.flush_files()
+        return self._borrow_connection()
+    
+    def _borrow_connection(self):
+        """Borrow a connection from the pool, or return None if the database is unreachable."""
+        if not self.pool:
+            self._connect()
+            if not self.pool:
+                return None
+                
+        # The pool checks the connection with a ping and reconnects it if
+        # needed, once per borrow rather than per statement, and the hot
+        # paths borrow once per batch rather than per operation. Statements
+        # use plain cursors: a borrowed connection is held for a single call, so
+        # a prepared statement would cost its own prepare and close round trips
+        self.slots.acquire()
+        try:
+            return self.pool.get_connection()
+        except Error as e:
+            self.slots.release()
+            logger.error(f"Error getting connection from pool: {e}")
+            return None
+    
+    def _release_connection(self, connection):
+        """Return a borrowed connection to the pool."""
         try:
-            self.connection = mysql.connector.connect(**config.DB_CONFIG)
-            if self.connection.is_connected():
-                logger.info("Connected to MySQL database")
+            # Without a session reset, end whatever a failed write or a read
+            # left open, so the next borrower starts a fresh transaction
+            if connection.in_transaction:
+                connection.rollback()
         except Error as e:
-            logger.error(f"Error connecting to MySQL database: {e}")
+            # The session is unusable (e.g. the server dropped it); the pool
+            # reconnects it on the next borrow
+            logger.error(f"Error rolling back pooled connection: {e}")
+            try:
+                connection._cnx.disconnect()
+            except Exception:
+                pass
+        finally:
+            try:
+                # Returns the connection to the pool whatever happened above
+                connection.close()
+            except Error as e:
+                logger.error(f"Error returning connection to pool: {e}")
+            finally:
+                self.slots.release()
             
     def _create_tables(self):
         """Create necessary tables if they don't exist."""
-        if not self.connection or not self.connection.is_connected():
+        connection = self._get_connection()
+        if not connection:
             logger.error("Cannot create tables: Database connection not established")
             return
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Files table
@@ -58,11 +168,31 @@ class DatabaseManager:
                     google_drive_id VARCHAR(255),
                     hash VARCHAR(64),
                     content_type VARCHAR(100),
+                    access_count BIGINT NOT NULL DEFAULT 0,
                     INDEX (directory),
-                    INDEX (needs_sync)
+                    INDEX needs_sync_mtime (needs_sync, mtime),
+                    INDEX (access_count)
                 )
             """)
             
+            # Tables from before access_count get the column, counted from their history
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'files' AND COLUMN_NAME = 'access_count'
+            """)
+            if not cursor.fetchone()[0]:
+                cursor.execute("""
+                    ALTER TABLE files
+                    ADD COLUMN access_count BIGINT NOT NULL DEFAULT 0,
+                    ADD INDEX (access_count)
+                """)
+                cursor.execute("""
+                    UPDATE files f
+                    JOIN (SELECT file_id, COUNT(*) AS n FROM access_history GROUP BY file_id) a
+                    ON f.id = a.file_id
+                    SET f.access_count = a.n
+                """)
+            
             # Extended attributes table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS extended_attributes (
@@ -82,10 +212,32 @@ class DatabaseManager:
                     file_id INT NOT NULL,
                     access_time DATETIME NOT NULL,
                     FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE,
-                    INDEX (file_id, access_time)
+                    INDEX (file_id, access_time),
+                    INDEX (access_time)
                 )
             """)
             
+            # Tables from before the sync index get it in place of the needs_sync
+            # one, so get_files_for_sync reads rows in mtime order without a sort
+            cursor.execute("""
+                SELECT INDEX_NAME FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'files'
+                AND INDEX_NAME IN ('needs_sync', 'needs_sync_mtime')
+            """)
+            index_names = {row[0] for row in cursor.fetchall()}
+            if 'needs_sync_mtime' not in index_names:
+                drop = "DROP INDEX needs_sync, " if 'needs_sync' in index_names else ""
+                cursor.execute(f"ALTER TABLE files {drop}ADD INDEX needs_sync_mtime (needs_sync, mtime)")
+                
+            # Tables from before retention get the index the prune deletes by
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'access_history'
+                AND COLUMN_NAME = 'access_time' AND SEQ_IN_INDEX = 1
+            """)
+            if not cursor.fetchone()[0]:
+                cursor.execute("ALTER TABLE access_history ADD INDEX (access_time)")
+            
             # Sync history
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS sync_history (
@@ -98,46 +250,69 @@ class DatabaseManager:
                 )
             """)
             
-            self.connection.commit()
+            # Content hashes, keyed by the file stat they were computed from
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS content_hashes (
+                    file_id INT PRIMARY KEY,
+                    size BIGINT NOT NULL,
+                    mtime_ns BIGINT NOT NULL,
+                    algorithm VARCHAR(16) NOT NULL,
+                    hash VARCHAR(64) NOT NULL,
+                    FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
+                )
+            """)
+            
+            # Google Drive folder IDs by directory path
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS drive_folders (
+                    path VARCHAR(255) PRIMARY KEY,
+                    drive_id VARCHAR(255) NOT NULL
+                )
+            """)
+            
+            connection.commit()
             logger.info("Database tables created or already exist")
             
         except Error as e:
             logger.error(f"Error creating database tables: {e}")
         finally:
             cursor.close()
+            self._release_connection(connection)
     
-    def _ensure_connection(self):
-        """Ensure database connection is active, reconnect if needed."""
-        if not self.connection or not self.connection.is_connected():
-            self._connect()
+    def _cache_file_id(self, path, file_id):
+        """Remember the id of a file's row, dropping all ids once there are too many."""
+        if len(self.file_ids) >= _FILE_ID_CACHE_MAX:
+            self.file_ids.clear()
+        self.file_ids[path] = file_id
     
     def add_file(self, path, mode):
         """Add a new file to the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Extract directory and filename
             directory = os.path.dirname(path)
             filename = os.path.basename(path)
             
-            # Get current timestamp
-            now = datetime.datetime.now()
-            
+            # Timestamps come from the server clock
             cursor.execute("""
                 INSERT INTO files 
                 (path, filename, directory, mode, atime, mtime, ctime, is_directory, needs_sync) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, NOW(), NOW(), NOW(), %s, %s) AS new
                 ON DUPLICATE KEY UPDATE 
-                mode=%s, mtime=%s, ctime=%s, needs_sync=%s
-            """, (path, filename, directory, mode, now, now, now, False, True,
-                 mode, now, now, True))
+                mode=new.mode, mtime=NOW(), ctime=NOW(), needs_sync=new.needs_sync
+            """, (path, filename, directory, mode, False, True))
+            
+            # One affected row means a fresh insert, whose id is lastrowid
+            if cursor.rowcount == 1:
+                self._cache_file_id(path, cursor.lastrowid)
                  
-            self.connection.commit()
-            logger.debug(f"Added file {path} to database")
+            connection.commit()
+            logger.debug("Added file %s to database", path)
             return True
             
         except Error as e:
@@ -145,34 +320,36 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def add_directory(self, path, mode):
         """Add a new directory to the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Extract parent directory and directory name
             parent_dir = os.path.dirname(path)
             dirname = os.path.basename(path)
             
-            # Get current timestamp
-            now = datetime.datetime.now()
-            
+            # Timestamps come from the server clock
             cursor.execute("""
                 INSERT INTO files 
                 (path, filename, directory, mode, atime, mtime, ctime, is_directory, needs_sync) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s, %s, %s, %s, NOW(), NOW(), NOW(), %s, %s) AS new
                 ON DUPLICATE KEY UPDATE 
-                mode=%s, mtime=%s, ctime=%s, needs_sync=%s
-            """, (path, dirname, parent_dir, mode, now, now, now, True, True,
-                 mode, now, now, True))
+                mode=new.mode, mtime=NOW(), ctime=NOW(), needs_sync=new.needs_sync
+            """, (path, dirname, parent_dir, mode, True, True))
+            
+            # One affected row means a fresh insert, whose id is lastrowid
+            if cursor.rowcount == 1:
+                self._cache_file_id(path, cursor.lastrowid)
                  
-            self.connection.commit()
-            logger.debug(f"Added directory {path} to database")
+            connection.commit()
+            logger.debug("Added directory %s to database", path)
             return True
             
         except Error as e:
@@ -180,19 +357,76 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
+    
+    def add_files_bulk(self, entries):
+        """
+        Add several files and directories to the database in one transaction.
+        
+        Args:
+            entries: List of (path, mode, is_directory) tuples
+        """
+        connection = self._borrow_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            # executemany sends the whole batch as one multi-row INSERT, with
+            # timestamps from the server clock
+            cursor.executemany("""
+                INSERT INTO files 
+                (path, filename, directory, mode, atime, mtime, ctime, is_directory, needs_sync) 
+                VALUES (%s, %s, %s, %s, NOW(), NOW(), NOW(), %s, %s) AS new
+                ON DUPLICATE KEY UPDATE 
+                mode=new.mode, mtime=NOW(), ctime=NOW(), needs_sync=new.needs_sync
+            """, [(path, os.path.basename(path), os.path.dirname(path), mode, is_directory, True)
+                  for path, mode, is_directory in entries])
+                  
+            connection.commit()
+            logger.debug("Added %s files to database", len(entries))
+            return True
+            
+        except Error as e:
+            logger.error(f"Error adding files to database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def queue_file(self, path, mode, is_directory=False):
+        """Queue a new file or directory to be added with the next batch."""
+        with self.pending_lock:
+            self.pending_files.append((path, mode, is_directory))
+            full = len(self.pending_files) >= config.DB_BATCH_SIZE
+            
+        if full:
+            self.flush_files()
+    
+    def flush_files(self):
+        """Add every queued file and directory to the database."""
+        with self.pending_lock:
+            if not self.pending_files:
+                return True
+                
+            entries, self.pending_files = self.pending_files, []
+            return self.add_files_bulk(entries)
     
     def remove_file(self, path):
         """Remove a file from the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             cursor.execute("DELETE FROM files WHERE path = %s", (path,))
-            self.connection.commit()
-            logger.debug(f"Removed file {path} from database")
+            connection.commit()
+            self.file_ids.pop(path, None)
+            self.version += 1
+            logger.debug("Removed file %s from database", path)
             return True
             
         except Error as e:
@@ -200,25 +434,32 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def remove_directory(self, path):
         """Remove a directory from the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Remove the directory
             cursor.execute("DELETE FROM files WHERE path = %s", (path,))
             
             # Also remove any files that were inside this directory
-            # This ensures we clean up orphaned records
-            cursor.execute("DELETE FROM files WHERE directory LIKE %s", (path + '%',))
+            # This ensures we clean up orphaned records. Wildcards in the path
+            # are escaped so the pattern stays a plain prefix, which MySQL reads
+            # as a range on the directory index (and /foo no longer matches /foobar)
+            prefix = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            cursor.execute("DELETE FROM files WHERE directory = %s OR directory LIKE %s",
+                           (path, prefix + '/%'))
             
-            self.connection.commit()
-            logger.debug(f"Removed directory {path} from database")
+            connection.commit()
+            self.file_ids.clear()
+            self.version += 1
+            logger.debug("Removed directory %s from database", path)
             return True
             
         except Error as e:
@@ -226,14 +467,15 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def rename_file(self, old_path, new_path):
         """Rename a file in the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Extract new directory and filename
@@ -247,8 +489,15 @@ class DatabaseManager:
                 WHERE path = %s
             """, (new_path, new_filename, new_directory, old_path))
             
-            self.connection.commit()
-            logger.debug(f"Renamed file from {old_path} to {new_path} in database")
+            connection.commit()
+            
+            # The row keeps its id under the new path
+            self.file_ids.pop(new_path, None)
+            file_id = self.file_ids.pop(old_path, None)
+            if file_id is not None:
+                self.file_ids[new_path] = file_id
+            self.version += 1
+            logger.debug("Renamed file from %s to %s in database", old_path, new_path)
             return True
             
         except Error as e:
@@ -256,23 +505,27 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def update_file_metadata(self, path, attr):
         """Update file metadata in the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
-            # Check if file exists
-            cursor.execute("SELECT id FROM files WHERE path = %s", (path,))
-            result = cursor.fetchone()
-            
-            if result:
-                file_id = result[0]
-                
+            # Check if file exists, unless its id is already known
+            file_id = self.file_ids.get(path)
+            if file_id is None:
+                cursor.execute("SELECT id FROM files WHERE path = %s", (path,))
+                result = cursor.fetchone()
+                if result:
+                    file_id = result[0]
+                    self._cache_file_id(path, file_id)
+                    
+            if file_id is not None:
                 # Convert timestamps
                 atime = datetime.datetime.fromtimestamp(attr['st_atime'])
                 mtime = datetime.datetime.fromtimestamp(attr['st_mtime'])
@@ -286,67 +539,196 @@ class DatabaseManager:
                 """, (attr['st_size'], attr['st_mode'], attr['st_uid'], attr['st_gid'], 
                      atime, mtime, ctime, file_id))
                 
-                self.connection.commit()
-                logger.debug(f"Updated metadata for file {path}")
+                connection.commit()
+                logger.debug("Updated metadata for file %s", path)
                 return True
-            else:
-                # File not found, add it if it's a valid path and not root
-                if path != "/" and os.path.exists(os.path.join(config.DEFAULT_STORAGE_PATH, path.lstrip('/'))):
-                    self.add_file(path, attr['st_mode'])
-                    return True
-                
-                return False
             
         except Error as e:
             logger.error(f"Error updating file metadata in database: {e}")
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
+            
+        # File not found, add it if it's a valid path and not root. This runs
+        # once the connection is back in the pool, as add_file borrows its own
+        if path != "/" and os.path.exists(os.path.join(config.DEFAULT_STORAGE_PATH, path.lstrip('/'))):
+            self.add_file(path, attr['st_mode'])
+            return True
+            
+        return False
     
-    def update_access_time(self, path):
-        """Update the access time for a file and add to access history."""
-        self._ensure_connection()
-        if not self.connection:
+    def update_files_metadata(self, files):
+        """
+        Store metadata for several files with a single multi-row upsert.
+        
+        Args:
+            files: List of (path, attr) tuples, attr as returned by getattr
+        """
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
-            now = datetime.datetime.now()
+            rows = []
+            for path, attr in files:
+                is_directory = stat.S_ISDIR(attr['st_mode'])
+                rows.append((path, os.path.basename(path), os.path.dirname(path),
+                             attr['st_size'], attr['st_mode'], attr['st_uid'], attr['st_gid'],
+                             datetime.datetime.fromtimestamp(attr['st_atime']),
+                             datetime.datetime.fromtimestamp(attr['st_mtime']),
+                             datetime.datetime.fromtimestamp(attr['st_ctime']),
+                             is_directory, not is_directory))
+                             
+            # executemany folds an INSERT into one statement for the whole batch;
+            # rows that already exist keep their sync state
+            cursor.executemany("""
+                INSERT INTO files
+                (path, filename, directory, size, mode, uid, gid, atime, mtime, ctime, is_directory, needs_sync)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) AS new
+                ON DUPLICATE KEY UPDATE
+                size = new.size, mode = new.mode, uid = new.uid, gid = new.gid,
+                atime = new.atime, mtime = new.mtime, ctime = new.ctime
+            """, rows)
+            
+            connection.commit()
+            logger.debug("Updated metadata for %s files", len(rows))
+            return True
             
-            # Update atime in files table
-            cursor.execute("UPDATE files SET atime = %s WHERE path = %s", (now, path))
+        except Error as e:
+            logger.error(f"Error updating file metadata in database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def update_access_time(self, path):
+        """Queue an access of a file for the access history."""
+        with self.access_lock:
+            self.pending_accesses.append((path, datetime.datetime.now()))
+            full = len(self.pending_accesses) >= config.DB_BATCH_SIZE
             
-            # Add to access history (for LFU algorithm)
-            cursor.execute("""
-                INSERT INTO access_history (file_id, access_time)
-                SELECT id, %s FROM files WHERE path = %s
-            """, (now, path))
+        if full:
+            self.flush_access_times()
+        return True
+    
+    def flush_access_times(self):
+        """Append every queued file access to the access history in one batch."""
+        with self.access_lock:
+            if not self.pending_accesses:
+                return True
+            accesses, self.pending_accesses = self.pending_accesses, []
             
-            self.connection.commit()
-            return True
+        connection = self._get_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            # Collect the ids locally, as other threads may clear the cache
+            # meanwhile, looking up paths not seen before a chunk per query
+            ids = {}
+            missing = []
+            for path in {path for path, _ in accesses}:
+                file_id = self.file_ids.get(path)
+                if file_id is None:
+                    missing.append(path)
+                else:
+                    ids[path] = file_id
+            for i in range(0, len(missing), _LOOKUP_BATCH_SIZE):
+                chunk = missing[i:i + _LOOKUP_BATCH_SIZE]
+                cursor.execute(f"SELECT path, id FROM files WHERE path IN ({', '.join(['%s'] * len(chunk))})",
+                               tuple(chunk))
+                for found_path, file_id in cursor.fetchall():
+                    ids[found_path] = file_id
+                    self._cache_file_id(found_path, file_id)
+                
+            # Insert-only, so reads never wait on row locks in files; accesses
+            # of paths the database doesn't know are dropped
+            rows = [(ids[path], when) for path, when in accesses if path in ids]
+            if rows:
+                cursor.executemany("""
+                    INSERT INTO access_history (file_id, access_time)
+                    VALUES (%s, %s)
+                """, rows)
+                
+                # Keep the per-file count next to the file, so rankings don't
+                # have to aggregate the history
+                counts = collections.Counter(file_id for file_id, _ in rows)
+                cursor.executemany("""
+                    UPDATE files SET access_count = access_count + %s WHERE id = %s
+                """, [(count, file_id) for file_id, count in counts.items()])
+                
+            connection.commit()
+            self.version += 1
             
         except Error as e:
             logger.error(f"Error updating access time in database: {e}")
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
+            
+        # Rankings come from access_count, so old history only takes up space
+        now = time.monotonic()
+        if self.last_prune is None or now - self.last_prune >= _PRUNE_INTERVAL:
+            self.last_prune = now
+            self.prune_access_history()
+        return True
+    
+    def prune_access_history(self, days=None):
+        """Delete access history older than the retention period, a batch per statement."""
+        days = config.ACCESS_HISTORY_DAYS if days is None else days
+        if days <= 0:
+            return 0
+            
+        connection = self._get_connection()
+        if not connection:
+            return 0
+            
+        cursor = connection.cursor()
+        
+        try:
+            # Small batches keep each statement's locks and undo log short
+            removed = 0
+            while True:
+                cursor.execute("""
+                    DELETE FROM access_history
+                    WHERE access_time < NOW() - INTERVAL %s DAY
+                    LIMIT %s
+                """, (days, _PRUNE_BATCH_SIZE))
+                connection.commit()
+                removed += cursor.rowcount
+                if cursor.rowcount < _PRUNE_BATCH_SIZE:
+                    break
+                    
+            if removed:
+                logger.info(f"Pruned {removed} access history rows older than {days} days")
+            return removed
+            
+        except Error as e:
+            logger.error(f"Error pruning access history in database: {e}")
+            return 0
+        finally:
+            cursor.close()
+            self._release_connection(connection)
     
     def update_modification_time(self, path):
         """Update the modification time for a file."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
-            now = datetime.datetime.now()
-            
             # Update mtime in files table
-            cursor.execute("UPDATE files SET mtime = %s WHERE path = %s", (now, path))
+            cursor.execute("UPDATE files SET mtime = NOW() WHERE path = %s", (path,))
             
-            self.connection.commit()
+            connection.commit()
             return True
             
         except Error as e:
@@ -354,20 +736,21 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def update_file_size(self, path, size):
         """Update the file size in the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Update size in files table
             cursor.execute("UPDATE files SET size = %s WHERE path = %s", (size, path))
             
-            self.connection.commit()
+            connection.commit()
             return True
             
         except Error as e:
@@ -375,20 +758,21 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def mark_for_sync(self, path):
         """Mark a file for synchronization to Google Drive."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             # Mark file for sync
             cursor.execute("UPDATE files SET needs_sync = TRUE WHERE path = %s", (path,))
             
-            self.connection.commit()
+            connection.commit()
             return True
             
         except Error as e:
@@ -396,14 +780,46 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
+    
+    def mark_files_written(self, files):
+        """
+        Update size and modification time of written files and mark them for sync.
+        
+        Args:
+            files: List of (path, size) tuples
+        """
+        connection = self._get_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            cursor.executemany("""
+                UPDATE files
+                SET size = %s, mtime = NOW(), needs_sync = TRUE
+                WHERE path = %s
+            """, [(size, path) for path, size in files])
+            
+            # One commit for the whole batch
+            connection.commit()
+            return True
+            
+        except Error as e:
+            logger.error(f"Error updating written files in database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
     
     def get_files_for_sync(self, limit=10):
         """Get files that need to be synchronized to Google Drive."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return []
             
-        cursor = self.connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=True)
         
         try:
             cursor.execute("""
@@ -421,41 +837,56 @@ class DatabaseManager:
             return []
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def update_sync_status(self, file_id, success, drive_id=None, error_message=None):
         """Update the synchronization status for a file."""
-        self._ensure_connection()
-        if not self.connection:
+        return self.update_sync_status_bulk([(file_id, success, drive_id, error_message)])
+    
+    def update_sync_status_bulk(self, results):
+        """
+        Update the synchronization status for several files in one transaction.
+        
+        Args:
+            results: List of (file_id, success, drive_id, error_message) tuples
+        """
+        if not results:
+            return True
+            
+        connection = self._get_connection()
+        if not connection:
             return False
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
-            now = datetime.datetime.now()
+            successes = [(drive_id, file_id) for file_id, success, drive_id, _ in results if success]
+            failures = [(file_id,) for file_id, success, _, _ in results if not success]
             
             # Update sync status
-            if success:
-                cursor.execute("""
+            if successes:
+                cursor.executemany("""
                     UPDATE files
-                    SET needs_sync = FALSE, last_synced = %s, google_drive_id = %s
+                    SET needs_sync = FALSE, last_synced = NOW(), google_drive_id = %s
                     WHERE id = %s
-                """, (now, drive_id, file_id))
-            else:
+                """, successes)
+            if failures:
                 # Keep needs_sync as TRUE if sync failed
-                cursor.execute("""
+                cursor.executemany("""
                     UPDATE files
-                    SET last_synced = %s
+                    SET last_synced = NOW()
                     WHERE id = %s
-                """, (now, file_id))
+                """, failures)
             
             # Add to sync history
-            status = "success" if success else "failed"
-            cursor.execute("""
+            cursor.executemany("""
                 INSERT INTO sync_history (file_id, sync_time, status, error_message)
-                VALUES (%s, %s, %s, %s)
-            """, (file_id, now, status, error_message))
+                VALUES (%s, NOW(), %s, %s)
+            """, [(file_id, "success" if success else "failed", error_message)
+                  for file_id, success, _, error_message in results])
             
-            self.connection.commit()
+            # One commit for the whole batch
+            connection.commit()
             return True
             
         except Error as e:
@@ -463,14 +894,15 @@ class DatabaseManager:
             return False
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def get_directory_files(self, directory):
         """Get files in a directory from the database."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return []
             
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         
         try:
             cursor.execute("""
@@ -486,41 +918,49 @@ class DatabaseManager:
             return []
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def get_most_accessed_files(self, limit=10):
         """Get the most frequently accessed files (for LFU algorithm)."""
-        self._ensure_connection()
-        if not self.connection:
+        now = time.monotonic()
+        cached = self.rankings.get(limit)
+        if cached is not None and cached[0] == self.version and now - cached[1] < _RANKING_CACHE_TTL:
+            return list(cached[2])
+            
+        version = self.version
+        connection = self._get_connection()
+        if not connection:
             return []
             
-        cursor = self.connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=True)
         
         try:
             cursor.execute("""
-                SELECT f.path, f.size, COUNT(a.id) as access_count
-                FROM files f
-                JOIN access_history a ON f.id = a.file_id
-                WHERE f.is_directory = FALSE
-                GROUP BY f.id
+                SELECT path, size, access_count
+                FROM files
+                WHERE is_directory = FALSE AND access_count > 0
                 ORDER BY access_count DESC
                 LIMIT %s
             """, (limit,))
             
-            return cursor.fetchall()
+            rows = cursor.fetchall()
+            self.rankings[limit] = (version, now, rows)
+            return list(rows)
             
         except Error as e:
             logger.error(f"Error getting most accessed files from database: {e}")
             return []
         finally:
             cursor.close()
+            self._release_connection(connection)
     
     def get_files_with_drive_ids(self):
         """Get all files that have Google Drive IDs."""
-        self._ensure_connection()
-        if not self.connection:
+        connection = self._get_connection()
+        if not connection:
             return []
             
-        cursor = self.connection.cursor(dictionary=True)
+        cursor = connection.cursor(dictionary=True)
         
         try:
             cursor.execute("""
@@ -536,9 +976,148 @@ class DatabaseManager:
             return []
         finally:
             cursor.close()
+            self._release_connection(connection)
+    
+    def get_content_hashes(self):
+        """Get all stored content hashes along with the stat they belong to."""
+        connection = self._get_connection()
+        if not connection:
+            return []
+            
+        cursor = connection.cursor(dictionary=True)
+        
+        try:
+            cursor.execute("""
+                SELECT f.path, f.google_drive_id, f.needs_sync,
+                       c.size, c.mtime_ns, c.algorithm, c.hash
+                FROM content_hashes c
+                JOIN files f ON f.id = c.file_id
+            """)
+            
+            return cursor.fetchall()
+            
+        except Error as e:
+            logger.error(f"Error getting content hashes from database: {e}")
+            return []
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def upsert_content_hash(self, path, size, mtime_ns, algorithm, content_hash):
+        """Store the content hash computed for a file."""
+        connection = self._get_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            cursor.execute("""
+                INSERT INTO content_hashes (file_id, size, mtime_ns, algorithm, hash)
+                SELECT id, %s, %s, %s, %s FROM files WHERE path = %s
+                ON DUPLICATE KEY UPDATE
+                size = VALUES(size), mtime_ns = VALUES(mtime_ns),
+                algorithm = VALUES(algorithm), hash = VALUES(hash)
+            """, (size, mtime_ns, algorithm, content_hash, path))
+            
+            connection.commit()
+            return True
+            
+        except Error as e:
+            logger.error(f"Error storing content hash in database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def get_drive_folders(self):
+        """Get all known Google Drive folder IDs."""
+        connection = self._get_connection()
+        if not connection:
+            return []
+            
+        cursor = connection.cursor(dictionary=True)
+        
+        try:
+            cursor.execute("SELECT path, drive_id FROM drive_folders")
+            
+            return cursor.fetchall()
+            
+        except Error as e:
+            logger.error(f"Error getting drive folders from database: {e}")
+            return []
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def upsert_drive_folder(self, path, drive_id):
+        """Store the Google Drive folder ID for a directory path."""
+        connection = self._get_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            cursor.execute("""
+                INSERT INTO drive_folders (path, drive_id)
+                VALUES (%s, %s) AS new
+                ON DUPLICATE KEY UPDATE drive_id = new.drive_id
+            """, (path, drive_id))
+            
+            connection.commit()
+            return True
+            
+        except Error as e:
+            logger.error(f"Error storing drive folder in database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
+    
+    def release_drive_copies(self, drive_id, path):
+        """
+        Detach other files from a Drive file whose content is being replaced.
+        
+        Files deduplicated onto the Drive file lose their copy, so they're
+        marked for sync again and no longer map their content hash to it.
+        
+        Args:
+            drive_id: The Drive file being overwritten
+            path: The file whose content it will hold
+        """
+        connection = self._get_connection()
+        if not connection:
+            return False
+            
+        cursor = connection.cursor()
+        
+        try:
+            cursor.execute("""
+                UPDATE files
+                SET google_drive_id = NULL, needs_sync = TRUE
+                WHERE google_drive_id = %s AND path != %s
+            """, (drive_id, path))
+            
+            connection.commit()
+            return True
+            
+        except Error as e:
+            logger.error(f"Error releasing drive copies in database: {e}")
+            return False
+        finally:
+            cursor.close()
+            self._release_connection(connection)
     
     def close(self):
-        """Close the database connection."""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            logger.info("Database connection closed")
\ No newline at end of file
+        """Write out queued rows and leave the pool, closing its idle connections if it was the last user."""
+        self.flush_files()
+        self.flush_access_times()
+        if self.pool:
+            self.pool = None
+            with DatabaseManager._shared_lock:
+                DatabaseManager._shared_users -= 1
+                if DatabaseManager._shared_users == 0:
+                    DatabaseManager._shared_pool._remove_connections()
+                    DatabaseManager._shared_pool = None
+                    logger.info("Database connection closed")
\ No newline at end of file
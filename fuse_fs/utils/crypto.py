@@ -4,19 +4,29 @@ Encryption and decryption utilities for the FUSE filesystem.
 import os
 import logging
 import base64
+from hashlib import sha256
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
-from Crypto.Util.Padding import pad, unpad
 
 from fuse_fs import config
 
 logger = logging.getLogger(__name__)
 
+# Bytes read per step when encrypting or decrypting a file
+_FILE_CHUNK_SIZE = 1 << 20
+
+# Encrypted data starts with the GCM nonce followed by the authentication tag
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+_HEADER_SIZE = _NONCE_SIZE + _TAG_SIZE
+
 class Crypto:
     """
     Encryption and decryption utilities for the FUSE filesystem.
     
-    Uses AES-256 in CBC mode for file encryption.
+    Uses AES-256 in GCM mode for authenticated file encryption. The public
+    enabled flag lets per-block callers skip encrypt/decrypt altogether
+    (data = crypto.encrypt(data) if crypto.enabled else data).
     """
     
     def __init__(self, key=None):
@@ -54,34 +64,37 @@ class Crypto:
     
     def _hash_key(self, key_bytes):
         """Hash the key to get a 32-byte key."""
-        from hashlib import sha256
         return sha256(key_bytes).digest()
     
     def encrypt(self, data):
         """
-        Encrypt data using AES-256-CBC.
+        Encrypt data using AES-256-GCM.
         
         Args:
             data: The data to encrypt (bytes)
             
         Returns:
-            The encrypted data with IV prepended
+            The encrypted data with nonce and authentication tag prepended, as a bytearray
         """
         if not self.enabled:
             return data
             
         try:
-            # Generate a random 16-byte initialization vector
-            iv = get_random_bytes(16)
+            # Generate a random 12-byte nonce, the size GCM is built around
+            nonce = get_random_bytes(_NONCE_SIZE)
             
-            # Create cipher with key and IV
-            cipher = AES.new(self.key, AES.MODE_CBC, iv)
+            # Create cipher with key and nonce
+            cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
             
-            # Encrypt and pad the data
-            encrypted_data = cipher.encrypt(pad(data, AES.block_size))
+            # Build nonce + tag + encrypted data in one buffer, with the cipher
+            # writing straight in after the header instead of concatenating
+            # copies. GCM needs no padding, so the sizes are known up front
+            encrypted = bytearray(_HEADER_SIZE + len(data))
+            encrypted[:_NONCE_SIZE] = nonce
+            cipher.encrypt(data, output=memoryview(encrypted)[_HEADER_SIZE:])
+            encrypted[_NONCE_SIZE:_HEADER_SIZE] = cipher.digest()
             
-            # Return IV + encrypted data
-            return iv + encrypted_data
+            return encrypted
             
         except Exception as e:
             logger.error(f"Encryption error: {e}")
@@ -90,34 +103,39 @@ class Crypto:
     
     def decrypt(self, data):
         """
-        Decrypt data using AES-256-CBC.
+        Decrypt data using AES-256-GCM.
         
         Args:
-            data: The encrypted data with IV prepended
+            data: The encrypted data with nonce and authentication tag prepended
             
         Returns:
-            The decrypted data
+            The decrypted data, as a bytearray, or None if it fails to decrypt
+            or authenticate (tampered with, or encrypted with another key)
         """
         if not self.enabled:
             return data
             
         try:
-            # Extract the 16-byte IV from the beginning of the data
-            iv = data[:16]
-            ciphertext = data[16:]
+            # Split off the nonce and tag from the beginning of the data,
+            # viewing the ciphertext in place rather than slicing a copy
+            view = memoryview(data)
+            nonce = bytes(view[:_NONCE_SIZE])
+            tag = bytes(view[_NONCE_SIZE:_HEADER_SIZE])
             
-            # Create cipher with key and IV
-            cipher = AES.new(self.key, AES.MODE_CBC, iv)
+            # Create cipher with key and nonce
+            cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
             
-            # Decrypt and unpad the data
-            decrypted_data = unpad(cipher.decrypt(ciphertext), AES.block_size)
+            # Decrypt into a buffer of the final size, failing if the data was tampered with
+            decrypted_data = bytearray(len(view) - _HEADER_SIZE)
+            cipher.decrypt(view[_HEADER_SIZE:], output=decrypted_data)
+            cipher.verify(tag)
             
             return decrypted_data
             
         except Exception as e:
             logger.error(f"Decryption error: {e}")
-            # If decryption fails, return the original data
-            return data
+            # Never hand back the ciphertext, or unauthenticated data, as plaintext
+            return None
     
     def encrypt_file(self, source_path, dest_path=None):
         """
@@ -134,20 +152,37 @@ class Crypto:
             return source_path
             
         dest_path = dest_path or source_path + '.encrypted'
+        part_path = dest_path + '.part'
         
         try:
-            with open(source_path, 'rb') as f_in:
-                data = f_in.read()
-                
-            encrypted_data = self.encrypt(data)
-            
-            with open(dest_path, 'wb') as f_out:
-                f_out.write(encrypted_data)
+            # Same layout as encrypt(), but streamed a chunk at a time so the
+            # file never has to fit in memory. The tag is only known at the
+            # end, so its slot is filled in once everything is written
+            nonce = get_random_bytes(_NONCE_SIZE)
+            cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+            
+            # Each chunk is read into the same buffer and encrypted in place
+            buffer = memoryview(bytearray(_FILE_CHUNK_SIZE))
+            with open(source_path, 'rb') as f_in, open(part_path, 'wb') as f_out:
+                f_out.write(nonce + bytes(_TAG_SIZE))
+                while True:
+                    length = f_in.readinto(buffer)
+                    if not length:
+                        break
+                    cipher.encrypt(buffer[:length], output=buffer[:length])
+                    f_out.write(buffer[:length])
+                    
+                f_out.seek(_NONCE_SIZE)
+                f_out.write(cipher.digest())
                 
+            # Written aside and moved in place, which also allows dest_path == source_path
+            os.replace(part_path, dest_path)
             return dest_path
             
         except Exception as e:
             logger.error(f"File encryption error for {source_path}: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
             return source_path
     
     def decrypt_file(self, source_path, dest_path=None):
@@ -159,24 +194,37 @@ class Crypto:
             dest_path: Path to save the decrypted file (optional)
             
         Returns:
-            The path to the decrypted file
+            The path to the decrypted file, or None if it fails to decrypt or
+            authenticate
         """
         if not self.enabled:
             return source_path
             
         dest_path = dest_path or source_path.replace('.encrypted', '')
+        part_path = dest_path + '.part'
         
         try:
-            with open(source_path, 'rb') as f_in:
-                data = f_in.read()
-                
-            decrypted_data = self.decrypt(data)
-            
-            with open(dest_path, 'wb') as f_out:
-                f_out.write(decrypted_data)
+            # Streamed like encrypt_file. The output only replaces dest_path
+            # once the tag has been verified
+            buffer = memoryview(bytearray(_FILE_CHUNK_SIZE))
+            with open(source_path, 'rb') as f_in, open(part_path, 'wb') as f_out:
+                nonce = f_in.read(_NONCE_SIZE)
+                tag = f_in.read(_TAG_SIZE)
+                cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+                while True:
+                    length = f_in.readinto(buffer)
+                    if not length:
+                        break
+                    cipher.decrypt(buffer[:length], output=buffer[:length])
+                    f_out.write(buffer[:length])
+                    
+                cipher.verify(tag)
                 
+            os.replace(part_path, dest_path)
             return dest_path
             
         except Exception as e:
             logger.error(f"File decryption error for {source_path}: {e}")
-            return source_path 
\ No newline at end of file
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return None
\ No newline at end of file
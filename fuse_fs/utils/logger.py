@@ -3,11 +3,69 @@ Logging utilities for the FUSE filesystem.
 """
 import os
 import sys
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener
 
 from fuse_fs import config
 
+# The real handlers, set by setup_logging, and the thread writing queued
+# records to them once start_listener has moved them onto it
+_handlers = []
+_listener = None
+
+class AppendFileHandler(logging.Handler):
+    """
+    Log handler that appends records to a file and rotates it by size.
+    
+    Rotates like RotatingFileHandler, but writes with os.write on an O_APPEND
+    descriptor and tracks the size in process instead of checking the file
+    before every record.
+    """
+    
+    def __init__(self, path, max_bytes, backup_count):
+        """Open the log file for appending."""
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._open()
+    
+    def _open(self):
+        """Open the log file and pick up its current size."""
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+    
+    def _rotate(self):
+        """Shift the backups up by one and start a new log file."""
+        os.close(self.fd)
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._open()
+    
+    def emit(self, record):
+        """Append a formatted record, rotating first if it would overflow the file."""
+        try:
+            data = (self.format(record) + '\n').encode('utf-8')
+            if self.backup_count > 0 and self.size and self.size + len(data) > self.max_bytes:
+                self._rotate()
+            os.write(self.fd, data)
+            self.size += len(data)
+        except Exception:
+            self.handleError(record)
+    
+    def close(self):
+        """Close the log file."""
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        super().close()
+
 def setup_logging(log_level=None, log_file=None):
     """
     Set up logging for the FUSE filesystem.
@@ -27,15 +85,20 @@ def setup_logging(log_level=None, log_file=None):
     logger = logging.getLogger('fuse_fs')
     logger.setLevel(level)
     
-    # Clear existing handlers
+    # Clear existing handlers, stopping the listener behind them
+    global _handlers, _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
     logger.handlers = []
+    handlers = []
     
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
     console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
     
     # Create file handler if log file is specified
     if file_path:
@@ -45,15 +108,21 @@ def setup_logging(log_level=None, log_file=None):
             os.makedirs(log_dir, exist_ok=True)
         
         # Create rotating file handler (10 MB max size, keep 5 backups)
-        file_handler = RotatingFileHandler(
+        file_handler = AppendFileHandler(
             file_path,
-            maxBytes=10*1024*1024,
-            backupCount=5
+            max_bytes=10*1024*1024,
+            backup_count=5
         )
         file_handler.setLevel(level)
         file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+        
+    # Written to directly until start_listener runs, as a listener thread
+    # started now wouldn't survive FUSE daemonizing with a fork
+    _handlers = handlers
+    for handler in handlers:
+        logger.addHandler(handler)
     
     # Log startup message
     logger.info(f"Logging initialized with level {logging.getLevelName(level)}")
@@ -62,6 +131,29 @@ def setup_logging(log_level=None, log_file=None):
     
     return logger
 
+def start_listener():
+    """
+    Move the fuse_fs logger's handlers onto a listener thread.
+    
+    Logging threads then only enqueue records and the listener does the console
+    and file writes, so FUSE and database calls never wait on them. Call this
+    once the process won't fork again, i.e. from the mounted filesystem's init.
+    """
+    global _listener
+    if _listener or not _handlers:
+        return
+    log_queue = queue.Queue(-1)
+    _listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+    logging.getLogger('fuse_fs').handlers = [QueueHandler(log_queue)]
+
+def _stop_listener():
+    """Write out the records still queued when the process exits."""
+    if _listener:
+        _listener.stop()
+
+atexit.register(_stop_listener)
+
 def get_logger(name=None):
     """
     Get a logger for a specific module.
@@ -56,6 +56,10 @@ echo "Installing required packages..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Byte-compile the package so the first start doesn't pay for it
+echo "Compiling Python modules..."
+python -m compileall -q fuse_fs
+
 # Set up environment file
 section "Setting up Environment"
 if [ -f ".env" ]; then
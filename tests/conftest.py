@@ -0,0 +1,55 @@
+"""
+Shared fixtures for the FUSE Virtual File System tests.
+"""
+import os
+import sys
+import logging
+import tempfile
+
+import pytest
+
+# Add the project root to the path once for the whole test session
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Keep test files on tmpfs where it's available, so the cache tests never hit the disk
+if sys.platform == 'linux' and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+    tempfile.tempdir = '/dev/shm'
+
+@pytest.fixture(scope='session', autouse=True)
+def quiet_logging():
+    """Disable logging during tests."""
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+@pytest.fixture(scope='session')
+def db():
+    """
+    A database manager shared by the whole session, so the connection pool
+    is only built once.
+    
+    Tests using it are skipped if the database isn't reachable.
+    """
+    # Imported here so the MySQL driver is only loaded when a test needs it
+    from fuse_fs.database.db_manager import DatabaseManager
+    
+    try:
+        manager = DatabaseManager()
+    except Exception as e:
+        pytest.skip(f"Database connection failed: {e}")
+    if manager.pool is None:
+        pytest.skip("Database connection failed")
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def temp_dir(tmp_path):
+    """A per-test scratch directory."""
+    return str(tmp_path)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """A per-test cache directory."""
+    path = tmp_path / 'cache'
+    path.mkdir()
+    return str(path)